@@ -0,0 +1,19 @@
+import os
+import glob
+import tempfile
+
+# Workers share metrics through files in this directory. It is set here rather than in the container's environment
+# so that management commands, which load the same metrics, keep prometheus_client's in-memory default
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'prometheus'))
+
+
+def on_starting(server) -> None:
+    # Samples left behind by a previous run would otherwise be merged into the new one
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.db')):
+        os.remove(path)
+
+def child_exit(server, worker) -> None:
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,99 @@
+import time
+import logging
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetrics:
+    __slots__ = ('sql_count', 'sql_time', 'cache_hits', 'cache_misses', 'sections')
+
+    def __init__(self) -> None:
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.sections: dict[str, float] = {}
+
+    def __call__(self, execute: Callable, sql: str, params: Any, many: bool, context: dict[str, Any]) -> Any:
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - began
+            self.sql_count += 1
+
+    def server_timing(self, total: float) -> str:
+        metrics = [
+            f'total;dur={total * 1000:.1f}',
+            f'sql;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"'
+        ]
+        metrics += [f'{name};dur={duration * 1000:.1f}' for name, duration in self.sections.items()]
+        return ', '.join(metrics)
+
+    def as_dict(self, total: float) -> dict[str, Any]:
+        return {
+            'duration_ms': round(total * 1000, 1),
+            'sql_count': self.sql_count,
+            'sql_ms': round(self.sql_time * 1000, 1),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            **{f'{name}_ms': round(duration * 1000, 1) for name, duration in self.sections.items()}
+        }
+
+
+_metrics: ContextVar[RequestMetrics | None] = ContextVar('request_metrics', default=None)
+
+
+@contextmanager
+def section(name: str) -> Iterator[None]:
+    metrics = _metrics.get()
+    if metrics is None:
+        yield
+        return
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.sections[name] = metrics.sections.get(name, 0.0) + time.perf_counter() - began
+
+def cache_lookup(hit: bool) -> bool:
+    metrics = _metrics.get()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+    return hit
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        if not settings.REQUEST_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        began = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        total = time.perf_counter() - began
+        response['Server-Timing'] = metrics.server_timing(total)
+        fields = {'method': request.method, 'path': request.path, 'status': response.status_code, **metrics.as_dict(total)}
+        logger.info(' '.join(f'{key}={value}' for key, value in fields.items()), extra={'request_metrics': fields})
+        return response
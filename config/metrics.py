@@ -0,0 +1,55 @@
+import os
+from typing import Any, Iterator
+from django.http import HttpRequest, HttpResponse
+from django.views import generic
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+TICKETS_PURCHASED = Counter('metro_tickets_purchased', 'Tickets purchased, by sales channel.', ['channel'])
+TICKET_SCANS = Counter('metro_ticket_scans', 'Gate scans, by outcome.', ['outcome'])
+ROUTE_SECONDS = Histogram(
+    'metro_route_calculation_seconds',
+    'Time spent answering route, hop and journey queries.',
+    ['kind'],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+)
+GRAPH_BUILD_SECONDS = Histogram(
+    'metro_graph_build_seconds',
+    'Time spent rebuilding in-process network structures after the network changes.',
+    ['graph'],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+)
+MAP_RENDER_SECONDS = Histogram(
+    'metro_map_render_seconds',
+    'Time spent rendering and publishing the network map, by outcome.',
+    ['outcome'],
+    buckets=(0.5, 1, 5, 10, 30, 60, 120, 300)
+)
+OTP_SENT = Counter('metro_otp_sent', 'OTP codes issued for ticket purchases.')
+OTP_CONFIRM_FAILURES = Counter('metro_otp_confirm_failures', 'Rejected OTP confirmations, by reason.', ['reason'])
+WALLET_DEBIT_CONFLICTS = Counter('metro_wallet_debit_conflicts', 'Wallet debits rejected because the balance no longer covered them.')
+
+
+class DatabaseCollector:
+    """Reads values that live in the database at scrape time, so they are the same whichever worker is scraped."""
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        from tickets.models import OutboundEmail
+        yield GaugeMetricFamily('metro_email_queue_depth', 'E-mails waiting to be delivered.', value=OutboundEmail.queue_depth())
+
+
+DATABASE_REGISTRY = CollectorRegistry(auto_describe=False)
+DATABASE_REGISTRY.register(DatabaseCollector())
+
+
+class MetricsView(generic.View):
+    http_method_names = ['get']
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        # Under gunicorn every worker writes its samples to files in this directory, which are merged here
+        if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return HttpResponse(generate_latest(registry) + generate_latest(DATABASE_REGISTRY), content_type=CONTENT_TYPE_LATEST)
@@ -62,6 +62,15 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
 
+# Gates hold this key to verify ticket tokens offline, so it must not be the Django secret key and has no default.
+TICKET_TOKEN_SECRET = config('TICKET_TOKEN_SECRET')
+
+# The cache backend needs a cache shared by all workers; the default LocMemCache is per-process.
+OTP_BACKEND = config('OTP_BACKEND', 'tickets.otp.DatabaseOTPBackend')
+
+# Adds Server-Timing headers and a timing log line per request; cheap enough to leave on in production.
+REQUEST_INSTRUMENTATION = bool(int(config('REQUEST_INSTRUMENTATION', '0')))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -101,6 +110,7 @@ SOCIALACCOUNT_PROVIDERS = {
 }
 
 MIDDLEWARE = [
+    'config.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -190,3 +200,20 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'mediafiles')
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler'
+        }
+    },
+    'loggers': {
+        'config.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False
+        }
+    }
+}
@@ -19,13 +19,15 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from django.views.generic import RedirectView
+from .metrics import MetricsView
 
 urlpatterns = [
     path('', RedirectView.as_view(pattern_name='tickets:dashboard', permanent=True)),
     path('admin/', admin.site.urls),
     path('tickets/', include('tickets.urls')),
     path('stations/', include('stations.urls')),
-    path('accounts/', include('allauth.urls'))
+    path('accounts/', include('allauth.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics')
 ]
 
 if settings.DEBUG:
@@ -1,8 +1,10 @@
-from typing import Any
 from django.contrib import admin
-from django.forms import ModelForm
+from django.db.models import OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce
 from django.http import HttpRequest
-from .models import Station, Line
+from django.utils import timezone
+from tickets.models import StationFootfall
+from .models import Station, Line, Segment
 
 # Register your models here.
 
@@ -10,20 +12,20 @@ from .models import Station, Line
 class StationAdmin(admin.ModelAdmin):
     fieldsets = (
         (None, {'fields': ('name', )}),
-        ('Relationships', {'fields': ('lines', 'neighbours')})
+        ('Relationships', {'fields': ('lines', 'neighbours')}),
+        ('Journey Planning', {'fields': ('transfer_time',), 'classes': ('collapse',)})
     )
-    list_display = ('name',)
+    list_display = ('name', 'daily_footfall')
     search_fields = ('name',)
     filter_horizontal = ('lines', 'neighbours')
 
-    def save_model(self, request: HttpRequest, obj: Any, form: ModelForm, change: bool) -> None:
-        obj.updated = True
-        return super().save_model(request, obj, form, change)
+    def get_queryset(self, request: HttpRequest) -> QuerySet:
+        footfall = StationFootfall.objects.filter(station=OuterRef('pk'), day=timezone.localdate())
+        return super().get_queryset(request).annotate(daily_footfall=Coalesce(Subquery(footfall.values('tickets')[:1]), 0))
 
-    def save_related(self, request, form, formsets, change):
-        super().save_related(request, form, formsets, change)
-        form.instance.updated = True
-        form.instance.save(update_fields=['updated'])
+    @admin.display(ordering='daily_footfall', description='Daily Footfall')
+    def daily_footfall(self, obj: Station) -> int:
+        return obj.daily_footfall # type: ignore
 
 class StationInline(admin.TabularInline):
     model = Station.lines.through
@@ -36,22 +38,21 @@ class StationInline(admin.TabularInline):
 class LineAdmin(admin.ModelAdmin):
     fieldsets = (
         (None, {'fields': ('name',)}),
-        ('Details', {'fields': ('color',), 'classes': ('collapse',)}),
+        ('Details', {'fields': ('color', 'run_time'), 'classes': ('collapse',)}),
         ('Services', {'fields': ('allow_ticket_purchase', 'is_running'), 'classes': ('collapse',)})
     )
     list_display = ('name', 'color', 'allow_ticket_purchase', 'is_running')
     inlines = (StationInline,)
     search_fields = ('name', 'color')
 
-    def save_model(self, request: HttpRequest, obj: Any, form: ModelForm, change: bool) -> None:
-        obj.updated = True
-        return super().save_model(request, obj, form, change)
-    
-    def save_related(self, request, form, formsets, change):
-        stations = set(form.instance.stations.all())
-        super().save_related(request, form, formsets, change)
-        form.instance.updated = True
-        form.instance.save(update_fields=['updated'])
-        new_stations = set(form.instance.stations.all())
-        affected_stations = [s.pk for s in stations | new_stations]
-        Station.objects.filter(pk__in=affected_stations).update(updated=True)
+
+@admin.register(Segment)
+class SegmentAdmin(admin.ModelAdmin):
+    fieldsets = (
+        (None, {'fields': ('start', 'stop', 'line')}),
+        ('Journey Planning', {'fields': ('run_time',)})
+    )
+    list_display = ('start', 'stop', 'line', 'run_time')
+    list_select_related = ('start', 'stop', 'line')
+    list_filter = ('line',)
+    search_fields = ('start__name', 'stop__name', 'line__name')
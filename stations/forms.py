@@ -6,7 +6,7 @@ class StationForm(forms.ModelForm):
     
     class Meta:
         model = Station
-        fields = ['name', 'lines', 'neighbours']
+        fields = ['name', 'lines', 'neighbours', 'transfer_time']
         widgets = {
             'lines': forms.CheckboxSelectMultiple(),
             'neighbours': forms.CheckboxSelectMultiple()
@@ -29,7 +29,7 @@ class LineForm(forms.ModelForm):
     
     class Meta:
         model = Line
-        fields = ['name', 'color']
+        fields = ['name', 'color', 'run_time']
         widgets = {
             'color': forms.TextInput(attrs={'type': 'color', 'style': 'height: 40px; padding: 2px;'}),
         }
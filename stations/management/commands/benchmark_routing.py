@@ -0,0 +1,86 @@
+import random
+import time
+import tracemalloc
+from collections import deque
+from django.core.management.base import BaseCommand
+from stations.routing import RouteMatrix
+from stations.utils import _create_graph, _create_routing_graph
+
+
+def _legacy_bfs(graph, start: str, stop: str) -> list[str]:
+    """The networkx dict-of-dicts BFS that routing used before the CSR engine."""
+    if start not in graph or stop not in graph:
+        return []
+    queue = deque([start])
+    visited = {start: None}
+    while queue:
+        current = queue.popleft()
+        if current == stop:
+            path = []
+            while current is not None:
+                path.append(current)
+                current = visited[current]
+            return list(reversed(path))
+        for neighbour in graph[current]:
+            if neighbour not in visited:
+                visited[neighbour] = current
+                queue.append(neighbour)
+    return []
+
+
+def _measure(func):
+    began = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - began
+    tracemalloc.start()
+    retained = func()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del retained
+    return result, elapsed, memory
+
+
+class Command(BaseCommand):
+    help = "Compares the networkx BFS with the CSR routing engine on the current network."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=2000, help='Number of random station pairs to route.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        graph, nx_build, nx_memory = _measure(_create_graph)
+        routing, csr_build, csr_memory = _measure(_create_routing_graph)
+        matrix, matrix_build, matrix_memory = _measure(lambda: RouteMatrix(routing))
+        if not len(routing):
+            self.stdout.write(self.style.WARNING("No stations to benchmark."))
+            return
+
+        rng = random.Random(options['seed'])
+        pks = [station.pk for station in routing.stations]
+        pairs = [(rng.choice(pks), rng.choice(pks)) for _ in range(options['queries'])]
+        indexed = [(routing.index[a], routing.index[b]) for a, b in pairs]
+
+        began = time.perf_counter()
+        legacy = [len(_legacy_bfs(graph, a, b)) for a, b in pairs]
+        nx_query = time.perf_counter() - began
+        began = time.perf_counter()
+        csr = [len(routing.bfs(a, b)) for a, b in indexed]
+        csr_query = time.perf_counter() - began
+        began = time.perf_counter()
+        lookups = [len(matrix.path(a, b)) for a, b in pairs]
+        matrix_query = time.perf_counter() - began
+
+        mismatches = sum(1 for a, b, c in zip(legacy, csr, lookups) if not a == b == c)
+        rows = (
+            ('networkx BFS', nx_build, nx_memory, nx_query),
+            ('CSR BFS', csr_build, csr_memory, csr_query),
+            ('Route matrix', csr_build + matrix_build, csr_memory + matrix_memory, matrix_query),
+        )
+        self.stdout.write(f"{len(routing)} stations, {len(routing.targets)} edges, {len(pairs)} queries")
+        self.stdout.write(f"{'engine':<14}{'build ms':>12}{'memory KiB':>14}{'us/query':>12}")
+        for name, build, memory, query in rows:
+            self.stdout.write(f"{name:<14}{build * 1000:>12.2f}{memory / 1024:>14.1f}{query / len(pairs) * 1e6:>12.2f}")
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"{mismatches} routes differ in length between engines."))
+        else:
+            self.stdout.write(self.style.SUCCESS("All engines agree on route lengths."))
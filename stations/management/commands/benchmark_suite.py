@@ -0,0 +1,287 @@
+import io
+import os
+import re
+import json
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from decimal import Decimal
+from unittest import mock
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from stations import utils as station_utils
+from stations.management.commands.generate_data import Command as Generator
+from stations.models import Station
+from stations.routing import MATRIX_MAX_STATIONS, RouteCache, RouteMatrix
+from stations.utils import _create_graph, _create_routing_graph, _save_graph, _update_layout
+from tickets import utils as ticket_utils
+from tickets.models import OutboundEmail, Ticket, Wallet
+from tickets.utils import calculate_ticket_price
+
+OTP_PATTERN = re.compile(r'Your OTP Code is (\d{6})')
+BENCH_USERNAME = 'benchmark'
+# Rough ridership shape for the generated scenarios: one rider per this many tickets, and stations per line
+TICKETS_PER_RIDER = 50
+STATIONS_PER_LINE = 50
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _sizes(value: str) -> list[int]:
+    return sorted({int(size) for size in value.split(',')})
+
+
+class Command(BaseCommand):
+    help = "Times graph builds, routing, pricing, map rendering and the purchase flow at several network and ticket-table sizes, with query counts, and writes the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stations', type=_sizes, default=[250, 1000], help='Comma-separated network sizes to generate.')
+        parser.add_argument('--tickets', type=_sizes, default=[0, 20000], help='Comma-separated ticket-table sizes to benchmark each network at.')
+        parser.add_argument('--current', action='store_true', help='Benchmark the configured database as it is instead of generated networks. Changes are rolled back.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark; the median is reported.')
+        parser.add_argument('--queries', type=int, default=500, help='Random station pairs per routing and pricing run.')
+        parser.add_argument('--skip-map', action='store_true', help='Skip the map layout and render benchmarks, which dominate on large networks.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline', help='Compare against an earlier JSON results file and fail on regressions.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against the baseline, as a fraction.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or options['queries'] < 1:
+            raise CommandError("--repeat and --queries must be positive.")
+        self.options = options
+        self.results = []
+        began = timezone.now()
+        setup_test_environment()
+        try:
+            with ExitStack() as stack:
+                # The layout cache lives beside the published maps, so benchmark renders use a scratch copy
+                layouts = stack.enter_context(tempfile.TemporaryDirectory())
+                stack.enter_context(mock.patch.object(station_utils, 'LAYOUT_PATH', f'{layouts}/layout.json'))
+                if options['current']:
+                    self._in_rollback(self.run_current)
+                else:
+                    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                    try:
+                        for stations in options['stations']:
+                            self._in_rollback(self.run_generated, stations)
+                    finally:
+                        connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            teardown_test_environment()
+            station_utils.CACHE.clear()
+            ticket_utils.CACHE.clear()
+
+        report = {
+            'started_at': began.isoformat(),
+            'revision': self._revision(),
+            'python': sys.version.split()[0],
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'options': {key: options[key] for key in ('stations', 'tickets', 'current', 'repeat', 'queries', 'seed')},
+            'results': self.results
+        }
+        self._print_results()
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
+        if options['baseline']:
+            self._compare(options['baseline'], options['tolerance'])
+
+    def _in_rollback(self, func, *args) -> None:
+        station_utils.CACHE.clear()
+        ticket_utils.CACHE.clear()
+        try:
+            with transaction.atomic():
+                func(*args)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def run_generated(self, stations: int) -> None:
+        generator = Generator(stdout=io.StringIO())
+        generator.rng = random.Random(self.options['seed'])
+        generator.chunk_size = 5000
+        generator.now = timezone.now()
+        self.stdout.write(f"Generating a {stations}-station network...")
+        generator.generate_network(stations, max(stations // STATIONS_PER_LINE, 1))
+        self.run_network(stations, 0)
+
+        trips = generator.generate_trips()
+        riders: list[int] = []
+        generated = 0
+        for tickets in self.options['tickets']:
+            if tickets > generated:
+                self.stdout.write(f"Filling the ticket table to {tickets} rows...")
+                wanted = max(tickets // TICKETS_PER_RIDER, 1) - len(riders)
+                if wanted > 0:
+                    riders += generator.generate_users(get_user_model(), wanted, f'bench{len(riders)}-', 1)
+                generator.generate_tickets(tickets - generated, riders, trips, 1)
+                generated = tickets
+            self.run_tickets(stations, tickets)
+
+    def run_current(self) -> None:
+        stations = Station.objects.count()
+        tickets = Ticket.objects.count()
+        self.stdout.write(f"Benchmarking the current database ({stations} stations, {tickets} tickets)...")
+        self.run_network(stations, tickets)
+        self.run_tickets(stations, tickets)
+
+    def run_network(self, stations: int, tickets: int) -> None:
+        graph = _create_routing_graph()
+        if len(graph) < 2:
+            raise CommandError("The network needs at least two stations to benchmark.")
+        rng = random.Random(self.options['seed'])
+        pks = [station.pk for station in graph.stations]
+        pairs = [(rng.choice(pks), rng.choice(pks)) for _ in range(self.options['queries'])]
+        indexed = [(graph.index[a], graph.index[b]) for a, b in pairs]
+        objects = {station.pk: station for station in graph.stations}
+        station_pairs = [(objects[a], objects[b]) for a, b in pairs]
+        scenario = (stations, tickets)
+
+        self._bench('routing_graph_build', scenario, _create_routing_graph)
+        self._bench('networkx_graph_build', scenario, _create_graph)
+        if len(graph) <= MATRIX_MAX_STATIONS:
+            self._bench('route_matrix_build', scenario, lambda: RouteMatrix(graph))
+        else:
+            self._bench('route_cache_fill', scenario, lambda: [RouteCache(graph).distance(a, b) for a, b in pairs[:100]], operations=min(len(pairs), 100))
+        self._bench('bfs', scenario, lambda: [graph.bfs(a, b) for a, b in indexed], operations=len(indexed))
+        # plan() memoizes journeys, so the uncached search is timed
+        planned = indexed[:len(indexed) // 10 or 1]
+        self._bench('plan_journey', scenario, lambda: [graph._plan(a, b, 'time') for a, b in planned], operations=len(planned))
+        self._bench('ticket_price', scenario, lambda: [calculate_ticket_price(a, b) for a, b in station_pairs], operations=len(station_pairs))
+        if not self.options['skip_map']:
+            self._bench('map_layout', scenario, self._cold_layout)
+            self._bench('map_render', scenario, _save_graph)
+
+    def run_tickets(self, stations: int, tickets: int) -> None:
+        User = get_user_model()
+        user = User.objects.create(username=BENCH_USERNAME, email=f'{BENCH_USERNAME}@example.com')
+        Wallet.objects.create(user=user, balance=Decimal('1000000000'))
+        client = Client()
+        client.force_login(user)
+        busiest = Ticket.objects.values_list('start', 'stop').annotate(count=Count('id')).order_by('-count').first()
+        if busiest is None:
+            names = list(Station.objects.order_by('pk').values_list('pk', flat=True)[:2])
+            busiest = (names[0], names[-1])
+        start, stop = busiest[:2]
+        scenario = (stations, tickets)
+
+        def buy():
+            response = client.post('/tickets/buy/', {'start': start, 'stop': stop})
+            if response.status_code != 302:
+                raise CommandError(f"Purchase from {start} to {stop} was not accepted (status {response.status_code}).")
+
+        def confirm():
+            code = OTP_PATTERN.search(OutboundEmail.objects.filter(recipient=user.email).latest('pk').body)
+            response = client.post('/tickets/confirm/', {'code': code.group(1)}) # type: ignore
+            if response.get('Location') != '/tickets/my/':
+                raise CommandError(f"Purchase confirmation failed (status {response.status_code}).")
+
+        self._bench_steps(scenario, ('purchase_request', buy), ('purchase_confirm', confirm))
+        heaviest = Ticket.objects.filter(user__isnull=False).values_list('user').annotate(count=Count('id')).order_by('-count').first()
+        if heaviest is not None:
+            client.force_login(User.objects.get(pk=heaviest[0]))
+        self._bench('ticket_list', scenario, lambda: client.get('/tickets/my/'))
+        user.delete()
+
+    def _cold_layout(self):
+        try:
+            os.remove(station_utils.LAYOUT_PATH)
+        except FileNotFoundError:
+            pass
+        return _update_layout()
+
+    def _bench(self, name: str, scenario: tuple[int, int], func, operations: int = 1) -> None:
+        # The first call fills per-process caches, so queries are counted on a warm call like the timed ones;
+        # the query log is capped, so it is emptied first or a full log would count nothing
+        func()
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        timings = []
+        for _ in range(self.options['repeat']):
+            began = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - began)
+        self._record(name, scenario, timings, len(queries), operations)
+
+    def _bench_steps(self, scenario: tuple[int, int], *steps) -> None:
+        """Times steps that only make sense in sequence, such as requesting and then confirming a purchase."""
+        timings: dict[str, list[float]] = {name: [] for name, _ in steps}
+        queries = {}
+        for run in range(-1, self.options['repeat'] + 1):
+            for name, func in steps:
+                if run < 0:
+                    func()
+                    continue
+                if not run:
+                    reset_queries()
+                    with CaptureQueriesContext(connection) as captured:
+                        func()
+                    queries[name] = len(captured)
+                    continue
+                began = time.perf_counter()
+                func()
+                timings[name].append(time.perf_counter() - began)
+        for name, _ in steps:
+            self._record(name, scenario, timings[name], queries[name], 1)
+
+    def _record(self, name: str, scenario: tuple[int, int], timings: list[float], queries: int, operations: int) -> None:
+        self.results.append({
+            'benchmark': name,
+            'stations': scenario[0],
+            'tickets': scenario[1],
+            'operations': operations,
+            'median_ms': round(statistics.median(timings) / operations * 1000, 4),
+            'min_ms': round(min(timings) / operations * 1000, 4),
+            'max_ms': round(max(timings) / operations * 1000, 4),
+            'queries': queries
+        })
+
+    def _print_results(self) -> None:
+        self.stdout.write(f"{'benchmark':<22}{'stations':>10}{'tickets':>10}{'median ms':>12}{'min ms':>12}{'queries':>9}")
+        for result in self.results:
+            self.stdout.write(
+                f"{result['benchmark']:<22}{result['stations']:>10}{result['tickets']:>10}"
+                f"{result['median_ms']:>12.3f}{result['min_ms']:>12.3f}{result['queries']:>9}"
+            )
+
+    def _compare(self, path: str, tolerance: float) -> None:
+        try:
+            with open(path) as file:
+                baseline = {(r['benchmark'], r['stations'], r['tickets']): r for r in json.load(file)['results']}
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Could not read baseline {path}: {e}")
+        regressions = []
+        for result in self.results:
+            previous = baseline.get((result['benchmark'], result['stations'], result['tickets']))
+            if previous is None:
+                continue
+            label = f"{result['benchmark']} at {result['stations']} stations / {result['tickets']} tickets"
+            if result['median_ms'] > previous['median_ms'] * (1 + tolerance):
+                regressions.append(f"{label}: {previous['median_ms']:.3f} -> {result['median_ms']:.3f} ms")
+            if result['queries'] > previous['queries']:
+                regressions.append(f"{label}: {previous['queries']} -> {result['queries']} queries")
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {path}."))
+
+    def _revision(self) -> str | None:
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
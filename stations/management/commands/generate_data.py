@@ -0,0 +1,274 @@
+import math
+import time
+import uuid
+import random
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, time as dt_time
+from decimal import Decimal
+from itertools import islice
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from stations.models import Station, Line, Segment
+from stations.signals import bump_network_version
+from stations.utils import _create_routing_graph
+from tickets.models import Ticket, Wallet, WalletTransaction, OTP, StationFootfall, TICKET_LIFETIME, OTP_LIFETIME
+from tickets.utils import PRICE_PER_HOP
+
+# Share of each line's stations that are interchanges with an earlier line
+INTERCHANGE_RATE = 0.04
+# Popular origins whose trips make up the ridership, each with a pool of destinations
+ROUTE_ORIGINS = 250
+DESTINATIONS_PER_ORIGIN = 40
+# Share of tickets bought at the counter without an account
+OFFLINE_SHARE = 0.05
+# Time-of-day mixture: (weight, mean hour, spread in hours); the remainder is spread over service hours
+RUSH_HOURS = ((0.35, 8.75, 0.9), (0.35, 18.25, 1.1))
+SERVICE_HOURS = (5.5, 23.5)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+@contextmanager
+def _explicit_timestamps(*models):
+    """auto_now_add would overwrite the generated purchase times, so it is switched off while inserting."""
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _hops_from(graph, source: int) -> dict[int, int]:
+    hops = {source: 0}
+    queue = deque([source])
+    while queue:
+        current = queue.popleft()
+        for edge in range(graph.offsets[current], graph.offsets[current + 1]):
+            neighbour = graph.targets[edge]
+            if neighbour not in hops:
+                hops[neighbour] = hops[current] + 1
+                queue.append(neighbour)
+    return hops
+
+
+class Command(BaseCommand):
+    help = "Generates a reproducible synthetic network and ridership (users, wallets, tickets, OTPs) for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stations', type=int, default=10000, help='Stations to generate. Use 0 to generate ridership on the existing network.')
+        parser.add_argument('--lines', type=int, default=40, help='Lines to spread the generated stations over.')
+        parser.add_argument('--users', type=int, default=100000, help='Users to generate, each with a wallet.')
+        parser.add_argument('--tickets', type=int, default=1000000, help='Tickets to generate.')
+        parser.add_argument('--otps', type=int, help='Pending OTPs to generate. Defaults to 1%% of the users.')
+        parser.add_argument('--days', type=int, default=7, help='Days of ridership, ending at --until.')
+        parser.add_argument('--until', type=datetime.fromisoformat, help='End of the ridership window (ISO datetime). Defaults to now; fix it to reproduce timestamps exactly.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per INSERT.')
+        parser.add_argument('--user-prefix', default='rider', help='Username prefix for generated users.')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.now = options['until'] or timezone.now()
+        if timezone.is_naive(self.now):
+            self.now = timezone.make_aware(self.now)
+        if options['days'] < 1 or self.chunk_size < 1:
+            raise CommandError("--days and --chunk-size must be positive.")
+        User = get_user_model()
+        if User.objects.filter(username__startswith=options['user_prefix']).exists():
+            raise CommandError(f"Users named '{options['user_prefix']}...' already exist. Pick another --user-prefix.")
+
+        if options['stations']:
+            if Station.objects.exists() or Line.objects.exists():
+                raise CommandError("A network already exists. Pass --stations 0 to generate ridership on it.")
+            if not 0 < options['lines'] <= options['stations'] // 2:
+                raise CommandError("Every line needs at least two stations.")
+            self._stage("network", self.generate_network, options['stations'], options['lines'])
+
+        users = self._stage("users and wallets", self.generate_users, User, options['users'], options['user_prefix'], options['days'])
+        trips = self._stage("trip pool", self.generate_trips)
+        if not trips:
+            raise CommandError("The network has no connected station pairs to generate tickets for.")
+        first_day = self._stage("tickets", self.generate_tickets, options['tickets'], users, trips, options['days'])
+        otps = options['otps'] if options['otps'] is not None else len(users) // 100
+        self._stage("OTPs", self.generate_otps, users, otps)
+        self._stage("footfall", StationFootfall.backfill, first_day, timezone.localdate(self.now))
+        self.stdout.write(self.style.SUCCESS("Synthetic data generated."))
+
+    def _stage(self, name, func, *args):
+        self.stdout.write(f"Generating {name}...")
+        began = time.perf_counter()
+        result = func(*args)
+        self.stdout.write(f"  done in {time.perf_counter() - began:.2f}s")
+        return result
+
+    def _insert(self, model, objects) -> int:
+        total = 0
+        for chunk in _chunks(objects, self.chunk_size):
+            model.objects.bulk_create(chunk)
+            total += len(chunk)
+        return total
+
+    def generate_network(self, stations: int, lines: int) -> None:
+        """Lays out each line as a chain of new stations, joined to earlier lines at a few interchanges so the network stays connected."""
+        rng = self.rng
+        per_line = math.ceil(stations / lines)
+        sequences = []
+        created = 0
+        for line in range(lines):
+            sequence = [rng.randrange(created)] if line else []
+            served = set(sequence)
+            new = 0
+            while new < per_line and created < stations:
+                if line and rng.random() < INTERCHANGE_RATE:
+                    station = rng.randrange(created)
+                    if station in served:
+                        continue
+                else:
+                    station = created
+                    created += 1
+                    new += 1
+                sequence.append(station)
+                served.add(station)
+            if len(sequence) > 1:
+                sequences.append(sequence)
+
+        names = [f'Station {i:06d}' for i in range(stations)]
+        line_names = [f'Line {i + 1:03d}' for i in range(len(sequences))]
+        # 0x9E3779 is odd, so multiplying by it permutes the 24-bit colour space and keeps colours unique
+        colors = [f'#{(i * 0x9E3779 + 0x3C6EF3) % 0x1000000:06X}' for i in range(len(sequences))]
+        station_lines = {(names[station], line_names[line]) for line, sequence in enumerate(sequences) for station in sequence}
+        segments = {}
+        for line, sequence in enumerate(sequences):
+            for a, b in zip(sequence, sequence[1:]):
+                run_time = rng.randrange(60, 241)
+                segments[names[a], names[b], line_names[line]] = run_time
+                segments[names[b], names[a], line_names[line]] = run_time
+        neighbours = sorted({(start, stop) for start, stop, _ in segments})
+
+        self._insert(Station, (Station(name=name) for name in names))
+        self._insert(Line, (Line(name=name, color=color) for name, color in zip(line_names, colors)))
+        self._insert(Station.lines.through, (Station.lines.through(station_id=s, line_id=l) for s, l in sorted(station_lines)))
+        self._insert(Station.neighbours.through, (Station.neighbours.through(from_station_id=a, to_station_id=b) for a, b in neighbours))
+        self._insert(Segment, (Segment(start_id=a, stop_id=b, line_id=l, run_time=t) for (a, b, l), t in sorted(segments.items())))
+        # Bulk inserts send no signals, so the network version is bumped here, the same way populate_data does
+        bump_network_version()
+        self.stdout.write(f"  {stations} stations, {len(sequences)} lines, {len(neighbours)} neighbour links")
+
+    def generate_users(self, User, count: int, prefix: str, days: int) -> list[int]:
+        rng = self.rng
+        password = make_password(None)
+        width = len(str(count))
+        self._insert(User, (
+            User(username=f'{prefix}{i:0{width}d}', email=f'{prefix}{i:0{width}d}@example.com', password=password)
+            for i in range(count)
+        ))
+        users = list(User.objects.filter(username__startswith=prefix).order_by('pk').values_list('pk', flat=True))
+        balances = [Decimal(rng.randrange(0, 200000)).scaleb(-2) for _ in users]
+        opened_at = self.now - timedelta(days=days)
+        self._insert(Wallet, (Wallet(user_id=user, balance=balance) for user, balance in zip(users, balances)))
+        # One opening top-up per wallet keeps the ledger audit clean
+        with _explicit_timestamps(WalletTransaction):
+            self._insert(WalletTransaction, (
+                WalletTransaction(wallet_id=user, amount=balance, balance_after=balance, kind=WalletTransaction.Kind.TOPUP, created_at=opened_at)
+                for user, balance in zip(users, balances)
+            ))
+        return users
+
+    def generate_trips(self) -> list[tuple[str, str, Decimal, float]]:
+        """Picks popular origins and destinations and prices each pair with one BFS per origin, since the route matrix does not scale to large networks."""
+        rng = self.rng
+        graph = _create_routing_graph()
+        size = len(graph)
+        if size < 2:
+            return []
+        popularity = [rng.paretovariate(1.2) for _ in range(size)]
+        origins = set(rng.choices(range(size), weights=popularity, k=min(ROUTE_ORIGINS, size)))
+        trips = []
+        for origin in sorted(origins):
+            hops = _hops_from(graph, origin)
+            reachable = [station for station in hops if station != origin]
+            if not reachable:
+                continue
+            for stop in set(rng.choices(reachable, weights=[popularity[s] for s in reachable], k=DESTINATIONS_PER_ORIGIN)):
+                trips.append((
+                    graph.stations[origin].pk,
+                    graph.stations[stop].pk,
+                    Decimal(hops[stop]) * PRICE_PER_HOP,
+                    popularity[origin] * popularity[stop]
+                ))
+        return trips
+
+    def _purchase_time(self, day) -> datetime:
+        rng = self.rng
+        pick = rng.random()
+        for weight, mean, spread in RUSH_HOURS:
+            if pick < weight:
+                hour = rng.gauss(mean, spread)
+                break
+            pick -= weight
+        else:
+            hour = rng.uniform(*SERVICE_HOURS)
+        hour = min(max(hour, SERVICE_HOURS[0]), SERVICE_HOURS[1])
+        return datetime.combine(day, dt_time.min, tzinfo=timezone.get_current_timezone()) + timedelta(hours=hour)
+
+    def _status(self, age: timedelta) -> str:
+        pick = self.rng.random()
+        if age > TICKET_LIFETIME:
+            return Ticket.State.USED if pick < 0.85 else Ticket.State.EXPIRED
+        if age > timedelta(hours=3):
+            return Ticket.State.USED if pick < 0.8 else Ticket.State.ACTIVE
+        if pick < 0.3:
+            return Ticket.State.ACTIVE
+        return Ticket.State.IN_USE if pick < 0.7 else Ticket.State.USED
+
+    def generate_tickets(self, count: int, users: list[int], trips: list, days: int):
+        rng = self.rng
+        now = self.now
+        today = timezone.localdate(now)
+        day_list = [today - timedelta(days=offset) for offset in range(days)]
+        rider_weights = [rng.paretovariate(1.5) for _ in users]
+        trip_weights = [trip[3] for trip in trips]
+
+        def chunk_tickets(size):
+            picked_trips = rng.choices(trips, weights=trip_weights, k=size)
+            riders = rng.choices(users, weights=rider_weights, k=size) if users else [None] * size
+            for (start, stop, price, _), rider in zip(picked_trips, riders):
+                created_at = min(self._purchase_time(rng.choice(day_list)), now - timedelta(seconds=rng.randrange(60, 3600)))
+                yield Ticket(
+                    id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                    start_id=start,
+                    stop_id=stop,
+                    user_id=None if rng.random() < OFFLINE_SHARE else rider,
+                    created_at=created_at,
+                    price=price,
+                    raw_status=self._status(now - created_at)
+                )
+
+        with _explicit_timestamps(Ticket):
+            remaining = count
+            while remaining:
+                size = min(self.chunk_size, remaining)
+                Ticket.objects.bulk_create(list(chunk_tickets(size)))
+                remaining -= size
+        return day_list[-1]
+
+    def generate_otps(self, users: list[int], count: int) -> int:
+        rng = self.rng
+        now = self.now
+        lifetime = int(OTP_LIFETIME.total_seconds())
+        with _explicit_timestamps(OTP):
+            return self._insert(OTP, (
+                OTP(user_id=user, code=f'{rng.randrange(10 ** 6):06d}', created_at=now - timedelta(seconds=rng.randrange(lifetime)))
+                for user in sorted(rng.sample(users, min(count, len(users))))
+            ))
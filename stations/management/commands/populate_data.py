@@ -1,9 +1,14 @@
 import csv
+import time
+import hashlib
 from io import StringIO
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction, IntegrityError
-from django.db.models import F
-from stations.models import Station, Line 
+from django.db.models import ProtectedError
+from stations.models import Station, Line
+from stations.signals import bump_network_version
+
+BATCH_SIZE = 5000
 
 # --- Data Definition (Copied from the provided files) ---
 
@@ -262,138 +267,200 @@ Airport Express,132|195|28|24|64|39|223
 
 # --- Core Parsing Functions ---
 
-def parse_stations():
+def read_csv(path=None, embedded=""):
+    """Yields CSV rows one at a time from a file on disk, or from the embedded data when no path is given."""
+    if path is None:
+        yield from csv.DictReader(StringIO(embedded))
+        return
+    with open(path, newline="", encoding="utf-8") as file:
+        yield from csv.DictReader(file)
+
+def parse_stations(rows):
     """
-    Parses STATIONS_CSV. 
-    Returns: stations_to_create, uid_to_name map, and neighbour map using station names (PKs).
+    Parses station rows (uid,name,neighbours).
+    Returns: uid_to_name map and a list of (station, neighbour) pairs using station names (PKs).
     """
     # Maps integer UID (from CSV) to Name (the PK)
     uid_to_name = {}
     # Stores neighbor relationships using the integer UID temporarily
-    name_to_raw_neighbours_uids = {}
-    stations_to_create = []
+    raw_neighbours = []
     
-    reader = csv.DictReader(StringIO(STATIONS_CSV))
-    for row in reader:
+    for row in rows:
         try:
             uid = int(row["uid"])
             name = row["name"].strip()
-            
-            # Neighbours are still read as UIDs temporarily
-            raw_neighbours_uids = [int(n) for n in row["neighbours"].split("|") if n]
-            
             uid_to_name[uid] = name
-            name_to_raw_neighbours_uids[name] = raw_neighbours_uids
-            
-            # **Correct:** Create Station object using 'name' as the primary key.
-            # No need to set pk=name as it's the default behavior for the PK field.
-            stations_to_create.append(Station(name=name))
+            raw_neighbours.extend((name, int(n)) for n in row["neighbours"].split("|") if n)
         except Exception as e:
             print(f"[Warn] Skipping malformed station row: {row} -- {e}")
             
     # Second pass: Convert UID neighbours to Name neighbours (the actual PKs)
-    final_neighbour_map = {}
-    for station_name, neighbour_uids in name_to_raw_neighbours_uids.items():
-        # Convert list of UID integers to a list of Name strings
-        neighbour_names = [uid_to_name.get(nuid) for nuid in neighbour_uids if nuid in uid_to_name]
-        final_neighbour_map[station_name] = [n for n in neighbour_names if n]
-
-    # The returned neighbour map is now keyed by Station Name and contains a list of Neighbour Names.
-    return stations_to_create, uid_to_name, final_neighbour_map
-
-def parse_lines():
-    """Parses LINES_CSV and prepares data for Line creation and linking to stations."""
-    lines_to_create = []
-    raw_line_data = []
-    reader = csv.DictReader(StringIO(LINES_CSV))
-    for row in reader:
+    neighbour_pairs = list(dict.fromkeys(
+        (station, uid_to_name[nuid]) for station, nuid in raw_neighbours if nuid in uid_to_name
+    ))
+    return uid_to_name, neighbour_pairs
+
+def parse_lines(rows, uid_to_name):
+    """
+    Parses line rows (name,stations[,color]).
+    Returns: line name to color map and a list of (station, line) pairs using names (PKs).
+    """
+    line_colors = {}
+    station_line_pairs = []
+    for row in rows:
         try:
             name = row["name"].strip()
-            # Stations are stored as a list of UIDs, which we will resolve to names later
-            raw_stations_uids = [int(s) for s in row["stations"].split("|") if s]
-            
-            # **1. Set Line Color**
-            # Line PK is 'name', so passing name as pk is correct here.
-            line_obj = Line(pk=name, name=name, color=COLOR_MAP.get(name, "#000000"))
-            lines_to_create.append(line_obj)
-            
-            raw_line_data.append({"line_object": line_obj, "station_uids": raw_stations_uids})
+            # **1. Set Line Color** - an explicit column wins, then the known palette, then a colour derived from the name
+            line_colors[name] = (row.get("color") or "").strip() or COLOR_MAP.get(name) or derive_color(name)
+            # Stations are stored as a list of UIDs, resolved to names here
+            station_line_pairs.extend(
+                (uid_to_name[int(s)], name) for s in row["stations"].split("|") if s and int(s) in uid_to_name
+            )
         except Exception as e:
             print(f"[Warn] Skipping malformed line row: {row} -- {e}")
-    return lines_to_create, raw_line_data
+    return line_colors, list(dict.fromkeys(station_line_pairs))
+
+def derive_color(name):
+    """Lines must have unique colours, so datasets without a colour column get a stable one per name."""
+    return "#" + hashlib.sha256(name.encode()).hexdigest()[:6].upper()
+
+def load_network(stations_path=None, lines_path=None):
+    """Reads the full network description from the given files, or from the embedded data."""
+    uid_to_name, neighbour_pairs = parse_stations(read_csv(stations_path, STATIONS_CSV))
+    line_colors, station_line_pairs = parse_lines(read_csv(lines_path, LINES_CSV), uid_to_name)
+    return set(uid_to_name.values()), line_colors, station_line_pairs, neighbour_pairs
 
 # --- Data Population Logic ---
 
-def run_populate_logic():
-    """Executes the data parsing and M2M relationship setting."""
-    
+StationLine = Station.lines.through
+Neighbour = Station.neighbours.through
+
+def run_populate_logic(stations_path=None, lines_path=None):
+    """Creates the whole network on an empty database, one bulk INSERT per table."""
+    station_names, line_colors, station_line_pairs, neighbour_pairs = load_network(stations_path, lines_path)
+
     # 1. Create Stations
-    print("[Step] Parsing and creating stations...")
-    stations_to_create, uid_to_name_map, final_neighbour_map = parse_stations()
-    Station.objects.bulk_create(stations_to_create)
-    # Fetch all created station objects, keyed by their PK (name)
-    station_objs = {s.pk: s for s in Station.objects.all()}
-    print(f"[Info] Created {len(station_objs)} stations.")
+    print("[Step] Creating stations...")
+    Station.objects.bulk_create([Station(name=name) for name in sorted(station_names)], batch_size=BATCH_SIZE)
+    print(f"[Info] Created {len(station_names)} stations.")
 
     # 2. Create Lines
-    print("[Step] Parsing and creating lines...")
-    lines_to_create, raw_line_data = parse_lines()
-    Line.objects.bulk_create(lines_to_create)
-    # Line objects are keyed by their PK (name)
-    line_objs = {l.name: l for l in lines_to_create}
-    print(f"[Info] Created {len(line_objs)} lines.")
-
-    # 3. Link Stations to Lines
+    print("[Step] Creating lines...")
+    Line.objects.bulk_create([Line(name=name, color=color) for name, color in line_colors.items()], batch_size=BATCH_SIZE)
+    print(f"[Info] Created {len(line_colors)} lines.")
+
+    # 3. Link Stations to Lines, straight into the through table
     print("[Step] Setting line-to-station relationships...")
-    for item in raw_line_data:
-        line_obj = line_objs.get(item["line_object"].pk)
-        
-        # Convert station UIDs to Names (the primary key for stations)
-        station_names = [uid_to_name_map.get(uid) for uid in item["station_uids"] if uid in uid_to_name_map]
-        
-        # Look up station objects using their Names (PK)
-        station_objs_list = [station_objs.get(name) for name in station_names if name]
-        
-        # **Link stations to their respective lines**
-        if line_obj and station_objs_list:
-            line_obj.stations.set(station_objs_list)
-    print("[Info] Set line-to-station relationships.")
-
-    # 4. Link Neighbouring Stations
+    StationLine.objects.bulk_create([StationLine(station_id=station, line_id=line) for station, line in station_line_pairs], batch_size=BATCH_SIZE)
+    print(f"[Info] Set {len(station_line_pairs)} line-to-station relationships.")
+
+    # 4. Link Neighbouring Stations, straight into the through table
     print("[Step] Setting station neighbour relationships...")
-    # final_neighbour_map is keyed by station name (PK) and contains neighbour names (PKs)
-    for station_name, neighbour_names in final_neighbour_map.items():
-        station_obj = station_objs.get(station_name)
-        
-        # Look up neighbour station objects using their Names (PK)
-        neighbour_objs = [station_objs.get(nname) for nname in neighbour_names if nname]
-        
-        # **Link neighbouring stations**
-        if station_obj and neighbour_objs:
-            station_obj.neighbours.set(neighbour_objs) 
-    print("[Info] Set station neighbour relationships.")
+    Neighbour.objects.bulk_create([Neighbour(from_station_id=station, to_station_id=neighbour) for station, neighbour in neighbour_pairs], batch_size=BATCH_SIZE)
+    print(f"[Info] Set {len(neighbour_pairs)} station neighbour relationships.")
+
+    # Bulk inserts send no signals, so the network version is bumped once here
+    bump_network_version()
     print("[Success] Data population complete.")
 
+def run_sync_logic(stations_path=None, lines_path=None, prune=False):
+    """
+    Makes the database match the given network, touching only what differs.
+    Relationships between stations in the file are synced exactly; stations and lines missing from the file are only deleted with prune.
+    Returns: a map of change counts, all zero when the database already matches.
+    """
+    station_names, line_colors, station_line_pairs, neighbour_pairs = load_network(stations_path, lines_path)
+    changes = {}
+
+    # 1. Stations
+    existing_stations = set(Station.objects.values_list("pk", flat=True))
+    new_stations = station_names - existing_stations
+    Station.objects.bulk_create([Station(name=name) for name in sorted(new_stations)], batch_size=BATCH_SIZE)
+    changes["stations created"] = len(new_stations)
+
+    # 2. Lines, including colour changes
+    existing_lines = dict(Line.objects.values_list("pk", "color"))
+    new_lines = [Line(name=name, color=color) for name, color in line_colors.items() if name not in existing_lines]
+    recoloured = [Line(name=name, color=color) for name, color in line_colors.items() if name in existing_lines and existing_lines[name] != color]
+    Line.objects.bulk_create(new_lines, batch_size=BATCH_SIZE)
+    Line.objects.bulk_update(recoloured, ["color"], batch_size=BATCH_SIZE)
+    changes["lines created"] = len(new_lines)
+    changes["lines recoloured"] = len(recoloured)
+
+    # 3. Through tables, diffed as sets of name pairs
+    changes["line links added"], changes["line links removed"] = sync_pairs(
+        StationLine, "station_id", "line_id", set(station_line_pairs), station_names, set(line_colors)
+    )
+    changes["neighbour links added"], changes["neighbour links removed"] = sync_pairs(
+        Neighbour, "from_station_id", "to_station_id", set(neighbour_pairs), station_names, station_names
+    )
+
+    # 4. Prune stations and lines the file no longer mentions
+    changes["stations deleted"] = changes["lines deleted"] = 0
+    if prune:
+        try:
+            changes["lines deleted"] = Line.objects.exclude(pk__in=line_colors).delete()[1].get(Line._meta.label, 0)
+            changes["stations deleted"] = Station.objects.exclude(pk__in=station_names).delete()[1].get(Station._meta.label, 0)
+        except ProtectedError as e:
+            raise CommandError(f"Cannot prune stations that still have tickets: {', '.join(sorted(str(o.pk) for o in e.protected_objects)[:10])}")
+
+    if any(changes.values()):
+        bump_network_version()
+    return changes
+
+def sync_pairs(through, left, right, wanted, left_scope, right_scope):
+    """Adds missing through rows and removes rows within scope that are not wanted. Returns: (added, removed)."""
+    existing = {}
+    for pk, a, b in through.objects.values_list("pk", left, right).iterator(chunk_size=BATCH_SIZE):
+        existing[a, b] = pk
+    stale = [pk for pair, pk in existing.items() if pair not in wanted and pair[0] in left_scope and pair[1] in right_scope]
+    missing = [pair for pair in wanted if pair not in existing]
+    for start in range(0, len(stale), BATCH_SIZE):
+        through.objects.filter(pk__in=stale[start:start + BATCH_SIZE]).delete()
+    through.objects.bulk_create([through(**{left: a, right: b}) for a, b in missing], batch_size=BATCH_SIZE)
+    return len(missing), len(stale)
+
 # --- Django Management Command ---
 
 class Command(BaseCommand):
-    help = "Populates the database with embedded metro station and line data."
+    help = "Populates the database with metro station and line data, embedded or from CSV files, optionally syncing an existing network."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stations", help="CSV file with uid,name,neighbours columns (neighbours are |-separated uids). Defaults to the embedded data.")
+        parser.add_argument("--lines", help="CSV file with name,stations[,color] columns (stations are |-separated uids). Defaults to the embedded data.")
+        parser.add_argument("--sync", action="store_true", help="Apply only the differences to an existing network instead of skipping it.")
+        parser.add_argument("--prune", action="store_true", help="With --sync, delete stations and lines that are not in the data.")
 
     @transaction.atomic
     def handle(self, *args, **options):
+        if options["prune"] and not options["sync"]:
+            raise CommandError("--prune only makes sense together with --sync.")
+        began = time.perf_counter()
+
+        if options["sync"]:
+            self.stdout.write(self.style.NOTICE("Syncing metro database..."))
+            changes = run_sync_logic(options["stations"], options["lines"], options["prune"])
+            for change, count in changes.items():
+                self.stdout.write(f"  {change}: {count}")
+            if any(changes.values()):
+                self.stdout.write(self.style.SUCCESS(f"Database synced in {time.perf_counter() - began:.2f}s."))
+            else:
+                self.stdout.write(self.style.SUCCESS("Database already matches the data; nothing changed."))
+            return
+
         # Check if data already exists to prevent duplicate population
         station_count = Station.objects.count()
         line_count = Line.objects.count()
         if station_count > 0 or line_count > 0:
             self.stdout.write(self.style.WARNING(
-                f"Population skipped: Station records ({station_count}), Line records ({line_count}) already exist."
+                f"Population skipped: Station records ({station_count}), Line records ({line_count}) already exist. Use --sync to update them."
             ))
             return
 
         try:
-            self.stdout.write(self.style.NOTICE("Starting population of metro database from embedded data..."))
-            run_populate_logic()
-            self.stdout.write(self.style.SUCCESS("Database populated successfully."))
+            self.stdout.write(self.style.NOTICE("Starting population of metro database..."))
+            run_populate_logic(options["stations"], options["lines"])
+            self.stdout.write(self.style.SUCCESS(f"Database populated successfully in {time.perf_counter() - began:.2f}s."))
         except IntegrityError as e:
             self.stderr.write(f"[ERROR] Integrity error during population: {e}")
             raise
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from stations.utils import get_map_status, render_pending_map
+
+
+class Command(BaseCommand):
+    help = "Renders the network map for the current network version if it is out of date."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for a render already in progress.')
+
+    def handle(self, *args, **options):
+        if not render_pending_map(timeout=options['timeout']):
+            raise CommandError("Another process is still rendering the map.")
+        status = get_map_status()
+        self.stdout.write(self.style.SUCCESS(f"Map is current at version {status['version']} (last render took {status['duration']}s)."))
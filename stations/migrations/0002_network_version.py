@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_network_version(apps, schema_editor):
+    NetworkVersion = apps.get_model('stations', 'NetworkVersion')
+    NetworkVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetworkVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='version')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='updated at')),
+            ],
+            options={
+                'verbose_name': 'Network Version',
+                'verbose_name_plural': 'Network Versions',
+            },
+        ),
+        migrations.RemoveField(
+            model_name='line',
+            name='updated',
+        ),
+        migrations.RemoveField(
+            model_name='station',
+            name='updated',
+        ),
+        migrations.RunPython(create_network_version, migrations.RunPython.noop),
+    ]
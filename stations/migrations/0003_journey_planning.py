@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0002_network_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='line',
+            name='run_time',
+            field=models.PositiveIntegerField(default=120, help_text='Default travel time between adjacent stations, in seconds.', verbose_name='run time'),
+        ),
+        migrations.AddField(
+            model_name='station',
+            name='transfer_time',
+            field=models.PositiveIntegerField(default=300, help_text='Time needed to change lines at this station, in seconds.', verbose_name='transfer time'),
+        ),
+        migrations.CreateModel(
+            name='Segment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_time', models.PositiveIntegerField(help_text='Travel time from start to stop on this line, in seconds.', verbose_name='run time')),
+                ('line', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='stations.line', verbose_name='line')),
+                ('start', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='departing_segments', to='stations.station', verbose_name='start')),
+                ('stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='arriving_segments', to='stations.station', verbose_name='stop')),
+            ],
+            options={
+                'verbose_name': 'Segment',
+                'verbose_name_plural': 'Segments',
+                'constraints': [models.UniqueConstraint(fields=('start', 'stop', 'line'), name='unique_segment')],
+            },
+        ),
+    ]
@@ -1,10 +1,10 @@
 from typing import Iterable
+from datetime import datetime
 from django.db import models, transaction
 from django.db.models import F
 from django.core.validators import RegexValidator
 from django.contrib import admin
 from django.utils import timezone
-from tickets.models import Ticket
 
 # Create your models here.
 
@@ -19,7 +19,7 @@ class Line(models.Model):
     color = models.CharField(verbose_name='color', max_length=7, unique=True, validators=[_hex_validator])
     allow_ticket_purchase = models.BooleanField(verbose_name='allow_ticket_purchase', default=True)
     is_running = models.BooleanField(verbose_name='is_running', default=True)
-    updated = models.BooleanField(verbose_name='updated', default=True)
+    run_time = models.PositiveIntegerField(verbose_name='run time', default=120, help_text='Default travel time between adjacent stations, in seconds.')
 
 
     class Meta:
@@ -40,18 +40,6 @@ class Line(models.Model):
             line.allow_ticket_purchase = not line.allow_ticket_purchase
             line.save(update_fields=['allow_ticket_purchase'])
 
-    def delete(self, *args, **kwargs) -> tuple[int, dict[str, int]]:
-        self.__class__.objects.all().update(updated=True)
-        return super().delete(*args, **kwargs)
-
-    def save(self, *args, **kwargs) -> None:
-        self.updated = True
-        if 'update_fields' in kwargs and kwargs['update_fields'] is not None:
-            fields = set(kwargs['update_fields'])
-            fields.add('updated')
-            kwargs['update_fields'] = list(fields)
-        super().save(*args, **kwargs)
-
     def __str__(self) -> str:
         return str(self.name)
     
@@ -63,7 +51,7 @@ class Station(models.Model):
     name = models.CharField(verbose_name='name', max_length=200, unique=True, primary_key=True)
     lines = models.ManyToManyField(to="stations.Line", related_name='stations', blank=True)
     neighbours = models.ManyToManyField(to='self', symmetrical=False, blank=True)
-    updated = models.BooleanField(verbose_name='updated', default=True)
+    transfer_time = models.PositiveIntegerField(verbose_name='transfer time', default=300, help_text='Time needed to change lines at this station, in seconds.')
 
 
     class Meta:
@@ -79,22 +67,56 @@ class Station(models.Model):
     )
     def footfall(self) -> int:
         today = timezone.localdate(timezone.now())
-        return Ticket.objects.filter(created_at__date=today).filter(models.Q(start=self) | models.Q(stop=self)).count()
-    
-    def delete(self, *args, **kwargs) -> tuple[int, dict[str, int]]:
-        self.__class__.objects.all().select_for_update().update(updated=True)
-        return super().delete(*args, **kwargs)
-
-    def save(self, *args, **kwargs) -> None:
-        self.updated = True
-        if 'update_fields' in kwargs and kwargs['update_fields'] is not None:
-            fields = set(kwargs['update_fields'])
-            fields.add('updated')
-            kwargs['update_fields'] = list(fields)
-        super().save(*args, **kwargs)
+        return self.footfalls.filter(day=today).values_list('tickets', flat=True).first() or 0 # type: ignore
 
     def __str__(self) -> str:
         return str(self.name)
     
     def __hash__(self) -> int:
         return hash(self.name)
+
+
+class Segment(models.Model):
+    start = models.ForeignKey(to='stations.Station', on_delete=models.CASCADE, related_name='departing_segments', verbose_name='start')
+    stop = models.ForeignKey(to='stations.Station', on_delete=models.CASCADE, related_name='arriving_segments', verbose_name='stop')
+    line = models.ForeignKey(to='stations.Line', on_delete=models.CASCADE, related_name='segments', verbose_name='line')
+    run_time = models.PositiveIntegerField(verbose_name='run time', help_text='Travel time from start to stop on this line, in seconds.')
+
+
+    class Meta:
+        verbose_name = 'Segment'
+        verbose_name_plural = 'Segments'
+        constraints = [
+            models.UniqueConstraint(fields=['start', 'stop', 'line'], name='unique_segment')
+        ]
+
+
+    def __str__(self) -> str:
+        return f'{self.start} -> {self.stop} ({self.line})'
+
+
+class NetworkVersion(models.Model):
+    version = models.PositiveBigIntegerField(verbose_name='version', default=0)
+    updated_at = models.DateTimeField(verbose_name='updated at', default=timezone.now)
+
+
+    class Meta:
+        verbose_name = 'Network Version'
+        verbose_name_plural = 'Network Versions'
+
+
+    @classmethod
+    def current(cls) -> tuple[int, datetime]:
+        row = cls.objects.filter(pk=1).values_list('version', 'updated_at').first()
+        if row is None:
+            row = cls.objects.get_or_create(pk=1)[0]
+            return row.version, row.updated_at
+        return row
+
+    @classmethod
+    def bump(cls) -> None:
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1, updated_at=timezone.now()):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    def __str__(self) -> str:
+        return str(self.version)
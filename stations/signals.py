@@ -0,0 +1,26 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Station, Line, Segment, NetworkVersion
+from .utils import expire_network_version
+
+
+@receiver(post_save, sender=Line)
+@receiver(post_save, sender=Station)
+@receiver(post_save, sender=Segment)
+@receiver(post_delete, sender=Line)
+@receiver(post_delete, sender=Station)
+@receiver(post_delete, sender=Segment)
+def network_saved(sender, **kwargs) -> None:
+    bump_network_version()
+
+@receiver(m2m_changed, sender=Station.lines.through)
+@receiver(m2m_changed, sender=Station.neighbours.through)
+def network_relations_changed(sender, action: str, **kwargs) -> None:
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_network_version()
+
+def bump_network_version() -> None:
+    NetworkVersion.bump()
+    # The map is re-rendered by the next map view, so bulk edits and management commands do not start a render thread
+    transaction.on_commit(expire_network_version)
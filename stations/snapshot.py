@@ -0,0 +1,43 @@
+from typing import Iterable
+
+
+class LineRecord:
+    __slots__ = ('name', 'color', 'running', 'purchasable')
+
+    def __init__(self, name: str, color: str, running: bool, purchasable: bool) -> None:
+        self.name = name
+        self.color = color
+        self.running = running
+        self.purchasable = purchasable
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class StationRecord:
+    __slots__ = ('name', 'lines', 'purchasable')
+
+    def __init__(self, name: str, lines: tuple[LineRecord, ...]) -> None:
+        self.name = name
+        self.lines = lines
+        self.purchasable = any(line.purchasable for line in lines)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class NetworkSnapshot:
+    __slots__ = ('stations', 'lines')
+
+    def __init__(self, stations: Iterable[str], lines: Iterable[tuple[str, str, bool, bool]], station_lines: Iterable[tuple[str, str]]) -> None:
+        self.lines = {name: LineRecord(name, color, running, purchasable) for name, color, running, purchasable in lines}
+        served: dict[str, list[LineRecord]] = {}
+        for station, line in station_lines:
+            served.setdefault(station, []).append(self.lines[line])
+        self.stations = {name: StationRecord(name, tuple(sorted(served.get(name, ()), key=str))) for name in stations}
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    def get(self, name: str) -> StationRecord | None:
+        return self.stations.get(name)
@@ -1,3 +1,102 @@
+import os
+import tempfile
+from unittest import mock
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from . import layout, utils
+from .models import Station, Line, NetworkVersion
+from .routing import RouteCache, RouteMatrix, build_route_lookup, MATRIX_MAX_STATIONS
+from .utils import _create_routing_graph
 
 # Create your tests here.
+
+
+class RouteLookupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        line = Line.objects.create(name='Blue', color='#0000FF')
+        names = [f'S{i}' for i in range(6)]
+        stations = [Station.objects.create(name=name) for name in names]
+        for station in stations:
+            station.lines.add(line)
+        for a, b in zip(stations, stations[1:]):
+            a.neighbours.add(b)
+            b.neighbours.add(a)
+        Station.objects.create(name='Island')
+
+    def test_cache_matches_matrix(self) -> None:
+        graph = _create_routing_graph()
+        matrix = RouteMatrix(graph)
+        cache = RouteCache(graph)
+        names = [station.pk for station in graph.stations]
+        for start in names:
+            for stop in names:
+                self.assertEqual(cache.distance(start, stop), matrix.distance(start, stop))
+                self.assertEqual(cache.path(start, stop), matrix.path(start, stop))
+
+    def test_unreachable_and_unknown_stations(self) -> None:
+        cache = RouteCache(_create_routing_graph())
+        self.assertIsNone(cache.distance('S0', 'Island'))
+        self.assertEqual(cache.path('S0', 'Island'), [])
+        self.assertIsNone(cache.distance('S0', 'Nowhere'))
+        self.assertEqual(cache.distance('S0', 'S5'), 5)
+
+    def test_large_networks_skip_the_matrix(self) -> None:
+        graph = _create_routing_graph()
+        self.assertIsInstance(build_route_lookup(graph), RouteMatrix)
+        graph.stations = graph.stations * (MATRIX_MAX_STATIONS // len(graph) + 1)
+        self.assertIsInstance(build_route_lookup(graph), RouteCache)
+
+
+class MapRenderTests(TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(utils, 'STATUS_PATH', os.path.join(directory.name, 'status.json'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        utils.CACHE.clear()
+
+    def test_failed_render_is_not_retried_on_every_view(self) -> None:
+        with mock.patch.object(utils, '_save_graph', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                utils.render_pending_map()
+        status = utils.get_map_status()
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(status['failed_version'], NetworkVersion.current()[0])
+        with mock.patch.object(utils, 'request_map_render') as request_map_render:
+            utils.get_map_url()
+            request_map_render.assert_not_called()
+            NetworkVersion.bump()
+            utils.expire_network_version()
+            utils.get_map_url()
+            request_map_render.assert_called_once()
+
+
+class LayoutTests(TestCase):
+
+    def test_sparse_layout_keeps_neighbours_close(self) -> None:
+        nodes = [f'S{i}' for i in range(60)]
+        edges = list(zip(nodes, nodes[1:]))
+        with mock.patch.object(layout, 'DENSE_MAX_STATIONS', 10), mock.patch.object(layout, 'PIVOT_COUNT', 8):
+            positions = layout.stress_layout(nodes, edges)
+            grown = layout.stress_layout(nodes + ['New'], edges + [('S59', 'New')], positions)
+        gap = lambda a, b: sum((x - y) ** 2 for x, y in zip(positions[a], positions[b])) ** 0.5
+        self.assertLess(gap('S0', 'S1') * 10, gap('S0', 'S59'))
+        self.assertEqual({node: grown[node] for node in nodes[:50]}, {node: positions[node] for node in nodes[:50]})
+
+
+class StationListConditionalTests(TestCase):
+
+    def _revalidate(self) -> int:
+        etag = self.client.get('/stations/list/').headers.get('ETag')
+        return self.client.get('/stations/list/', headers={'if-none-match': etag or '*'}).status_code
+
+    def test_riders_get_not_modified(self) -> None:
+        self.assertEqual(self._revalidate(), 304)
+
+    def test_staff_always_get_a_fresh_page(self) -> None:
+        self.client.force_login(get_user_model().objects.create_user('staff', 'staff@example.com', 'password', is_staff=True))
+        self.assertEqual(self._revalidate(), 200)
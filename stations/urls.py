@@ -2,6 +2,8 @@ from django.urls import path
 from .views import (
     StationListView,
     MapRedirectView,
+    MapStatusView,
+    RouteView,
     StationCreateView,
     StationDeleteView,
     LineCreateView,
@@ -16,6 +18,8 @@ app_name = 'stations'
 urlpatterns = [
     path('list/', StationListView.as_view(), name='list'),
     path('map/', MapRedirectView.as_view(), name='map'),
+    path('map/status/', MapStatusView.as_view(), name='map_status'),
+    path('route/', RouteView.as_view(), name='route'),
     path('create/', StationCreateView.as_view(), name='create'),
     path('update/<str:pk>/', StationUpdateView.as_view(), name='update'),
     path('delete/<str:pk>/', StationDeleteView.as_view(), name='delete'),
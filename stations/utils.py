@@ -1,78 +1,202 @@
 import os
+import glob
+import gzip
+import json
 import time
+import brotli
+import hashlib
+import logging
 import portalocker
-import networkx as nx
-from collections import deque
-from pyvis.network import Network
+from datetime import datetime
+from threading import Lock, Thread
+from typing import TYPE_CHECKING, Any, Iterable
 from django.conf import settings
-from .models import Station, Line
+from django.db import connection
+from django.utils import timezone
+from config.instrumentation import cache_lookup, section
+from config.metrics import GRAPH_BUILD_SECONDS, MAP_RENDER_SECONDS, ROUTE_SECONDS
+from .models import Station, Line, Segment, NetworkVersion
+from .layout import stress_layout
+from .routing import RoutingGraph, RouteMatrix, RouteCache, Journey, build_route_lookup
+from .snapshot import NetworkSnapshot
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+logger = logging.getLogger(__name__)
 
 CACHE = {}
 
 MAPS_DIR = os.path.join(settings.MEDIA_ROOT, 'maps')
 os.makedirs(MAPS_DIR, exist_ok=True)
-HTML_PATH = os.path.join(MAPS_DIR, f'graph.html')
+MAP_HISTORY = 3
+STATUS_PATH = os.path.join(MAPS_DIR, 'status.json')
+RENDER_LOCK_PATH = os.path.join(MAPS_DIR, 'render.lock')
+LAYOUT_PATH = os.path.join(MAPS_DIR, 'layout.json')
+RENDER_LOCK = Lock()
+
+VERSION_CHECK_INTERVAL = 2.0
+RENDER_RETRY_DELAY = 300
 
 def calculate_route(start: Station, stop: Station) -> tuple[Station, ...]:
-    graph = _get_graph()
-    pk_path = _bfs(graph, start.pk, stop.pk)
-    stations = Station.objects.in_bulk(pk_path)
-    return tuple([stations[pk] for pk in pk_path if pk in stations])
-    
-def _bfs(graph: nx.DiGraph, start: str, stop: str) -> list[str]:
-    if start not in graph or stop not in graph:
-        return []
-    queue = deque([start])
-    visited = {start: None}
-    while queue:
-        current = queue.popleft()
-        if current == stop:
-            return _get_path(visited, stop)
-        for neighbour in graph[current]:
-            if neighbour not in visited:
-                visited[neighbour] = current # type: ignore
-                queue.append(neighbour)
-    return []
-
-def _get_path(visited, stop: str):
-    path = []
-    current = stop
-    while current is not None:
-        path.append(current)
-        current = visited[current]
-    return list(reversed(path))
+    matrix = _get_route_matrix()
+    with section('route'), ROUTE_SECONDS.labels('path').time():
+        return tuple([matrix.graph.stations[i] for i in matrix.path(start.pk, stop.pk)])
+
+def calculate_hops(start: Station, stop: Station) -> int | None:
+    matrix = _get_route_matrix()
+    with section('route'), ROUTE_SECONDS.labels('hops').time():
+        return matrix.distance(start.pk, stop.pk)
+
+def calculate_hops_many(pairs: Iterable[tuple[str, str]]) -> list[int | None]:
+    matrix = _get_route_matrix()
+    with section('route'), ROUTE_SECONDS.labels('hops').time():
+        return [matrix.distance(start, stop) for start, stop in pairs]
+
+def plan_journey(start: str, stop: str, criterion: str = 'time') -> Journey | None:
+    graph = _get_routing_graph()
+    if start not in graph.index or stop not in graph.index:
+        return None
+    with section('route'), ROUTE_SECONDS.labels('journey').time():
+        return graph.plan(graph.index[start], graph.index[stop], criterion)
+
+def _get_route_matrix() -> RouteMatrix | RouteCache:
+    graph = _get_routing_graph()
+    if cache_lookup('matrix' in CACHE and CACHE['matrix'].graph is graph):
+        return CACHE['matrix']
+    with section('graph'), GRAPH_BUILD_SECONDS.labels('matrix').time():
+        matrix = build_route_lookup(graph)
+    CACHE['matrix'] = matrix
+    return matrix
+
+def _get_routing_graph() -> RoutingGraph:
+    version = get_network_version()
+    if cache_lookup(CACHE.get('routing_version') == version):
+        return CACHE['routing']
+    with section('graph'), GRAPH_BUILD_SECONDS.labels('routing').time():
+        graph = _create_routing_graph()
+    CACHE['routing'] = graph
+    CACHE['routing_version'] = version
+    return graph
+
+def _create_routing_graph() -> RoutingGraph:
+    return RoutingGraph(
+        stations=Station.objects.order_by('pk'),
+        lines=Line.objects.order_by('pk'),
+        station_lines=Station.lines.through.objects.values_list('station_id', 'line_id'),
+        neighbours=Station.neighbours.through.objects.values_list('from_station_id', 'to_station_id'),
+        segments=Segment.objects.values_list('start_id', 'stop_id', 'line_id', 'run_time')
+    )
+
+def get_network_snapshot() -> NetworkSnapshot:
+    version = get_network_version()
+    if cache_lookup(CACHE.get('snapshot_version') == version):
+        return CACHE['snapshot']
+    with section('snapshot'), GRAPH_BUILD_SECONDS.labels('snapshot').time():
+        snapshot = NetworkSnapshot(
+            stations=Station.objects.order_by('pk').values_list('pk', flat=True),
+            lines=Line.objects.values_list('pk', 'color', 'is_running', 'allow_ticket_purchase'),
+            station_lines=Station.lines.through.objects.values_list('station_id', 'line_id')
+        )
+    CACHE['snapshot'] = snapshot
+    CACHE['snapshot_version'] = version
+    return snapshot
+
+def get_network_version() -> int:
+    now = time.monotonic()
+    # Read once: another thread may expire the cached version between a check and a second lookup
+    version = CACHE.get('version')
+    if not cache_lookup(version is not None and now - CACHE.get('version_checked_at', 0) <= VERSION_CHECK_INTERVAL):
+        version, CACHE['version_updated_at'] = NetworkVersion.current()
+        CACHE['version'] = version
+        CACHE['version_checked_at'] = now
+    return version
+
+def get_network_updated_at() -> datetime:
+    get_network_version()
+    return CACHE['version_updated_at']
+
+def expire_network_version() -> None:
+    CACHE.pop('version', None)
 
 def get_map_url() -> str:
-    if not os.path.exists(HTML_PATH) or _is_updated():
-        try:
-            with portalocker.Lock(HTML_PATH, mode='a', timeout=30):
-                if not os.path.exists(HTML_PATH) or _is_updated():
-                    _save_graph()
-                    _reset_updated()
-        except portalocker.exceptions.LockException:
-            return '/stations/list/'
-    timestamp = int(time.time())
-    return f'{settings.MEDIA_URL}maps/graph.html?v={timestamp}'
-
-def _is_updated() -> bool:
-    updated_stations = Station.objects.filter(updated=True)
-    updated_lines = Line.objects.filter(updated=True)
-    if not updated_lines.exists() and not updated_stations.exists():
+    status = get_map_status()
+    version = get_network_version()
+    if not _is_current(status, version) and not _recently_failed(status, version):
+        request_map_render()
+    if 'file' not in status:
+        return '/stations/list/'
+    return f'{settings.MEDIA_URL}maps/{status["file"]}'
+
+def get_map_status() -> dict[str, Any]:
+    return _read_json(STATUS_PATH) or {'state': 'idle'}
+
+def request_map_render() -> None:
+    if not RENDER_LOCK.locked():
+        Thread(target=_render_in_background, name='map-renderer').start()
+
+def render_pending_map(timeout: float = 0) -> bool:
+    try:
+        with portalocker.Lock(RENDER_LOCK_PATH, mode='a', timeout=timeout, fail_when_locked=not timeout):
+            while True:
+                version = NetworkVersion.current()[0]
+                if _is_current(get_map_status(), version):
+                    return True
+                _render_map(version)
+    except portalocker.exceptions.LockException:
         return False
-    return True
 
-def _reset_updated() -> None:
-    Station.objects.filter(updated=True).update(updated=False)
-    Line.objects.filter(updated=True).update(updated=False)
+def _is_current(status: dict[str, Any], version: int) -> bool:
+    return status.get('version') == version and 'file' in status
 
-def _get_graph() -> nx.DiGraph:
-    if 'graph' in CACHE and not _is_updated():
-        return CACHE['graph']
-    graph = _create_graph()
-    CACHE['graph'] = graph
-    return graph
+def _recently_failed(status: dict[str, Any], version: int) -> bool:
+    if status.get('failed_version') != version or 'failed_at' not in status:
+        return False
+    return (timezone.now() - datetime.fromisoformat(status['failed_at'])).total_seconds() < RENDER_RETRY_DELAY
+
+def _render_in_background() -> None:
+    if not RENDER_LOCK.acquire(blocking=False):
+        return
+    try:
+        render_pending_map()
+    except Exception:
+        logger.exception('Map render failed')
+    finally:
+        RENDER_LOCK.release()
+        connection.close()
+
+def _render_map(version: int) -> None:
+    status = get_map_status()
+    status.update(state='rendering', started_at=timezone.now().isoformat())
+    _write_json(STATUS_PATH, status)
+    began = time.perf_counter()
+    try:
+        with section('map'):
+            filename = _publish_map(_save_graph())
+    except Exception as e:
+        MAP_RENDER_SECONDS.labels('failed').observe(time.perf_counter() - began)
+        status.update(state='failed', error=f'{type(e).__name__}: {e}', failed_version=version, failed_at=timezone.now().isoformat())
+        _write_json(STATUS_PATH, status)
+        raise
+    duration = time.perf_counter() - began
+    MAP_RENDER_SECONDS.labels('published').observe(duration)
+    status.update(state='idle', version=version, file=filename, duration=round(duration, 3), rendered_at=timezone.now().isoformat(), error=None)
+    _write_json(STATUS_PATH, status)
 
-def _create_graph() -> nx.DiGraph:
+def _read_json(path: str) -> Any:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path: str, data: Any) -> None:
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(f'{path}.tmp', path)
+
+def _create_graph() -> 'nx.DiGraph':
+    import networkx as nx
     G: nx.DiGraph = nx.DiGraph()
     all_stations = Station.objects.prefetch_related('lines', 'neighbours', 'neighbours__lines')
     all_station_lines = {}
@@ -102,16 +226,51 @@ def _create_graph() -> nx.DiGraph:
     G.remove_nodes_from(list(nx.isolates(G)))
     return G
 
-def _save_graph():
-    G = _get_graph()
+def _update_layout() -> dict[str, list[float]]:
+    nodes = sorted(Station.objects.values_list('pk', flat=True))
+    edges = sorted({tuple(sorted(pair)) for pair in Station.neighbours.through.objects.values_list('from_station_id', 'to_station_id')})
+    stored = _read_json(LAYOUT_PATH) or {}
+    previous_edges = {tuple(edge) for edge in stored.get('edges', [])}
+    changed = {station for edge in previous_edges.symmetric_difference(edges) for station in edge}
+    positions = stress_layout(nodes, edges, stored.get('positions'), changed)
+    _write_json(LAYOUT_PATH, {'positions': positions, 'edges': edges})
+    return positions
+
+def _publish_map(html: str) -> str:
+    content = html.encode()
+    filename = f'graph.{hashlib.sha256(content).hexdigest()[:16]}.html'
+    path = os.path.join(MAPS_DIR, filename)
+    if not os.path.exists(path):
+        for suffix, compressed in (('.gz', gzip.compress(content, compresslevel=9, mtime=0)), ('.br', brotli.compress(content))):
+            _write_bytes(f'{path}{suffix}', compressed)
+        _write_bytes(path, content)
+    os.utime(path)
+    _collect_old_maps(keep=filename)
+    return filename
+
+def _collect_old_maps(keep: str) -> None:
+    maps = sorted(glob.glob(os.path.join(MAPS_DIR, 'graph.*.html')), key=os.path.getmtime, reverse=True)
+    stale = [path for path in maps if os.path.basename(path) != keep][MAP_HISTORY - 1:]
+    for path in stale + [os.path.join(MAPS_DIR, 'graph.html')]:
+        for variant in (path, f'{path}.gz', f'{path}.br'):
+            try:
+                os.remove(variant)
+            except FileNotFoundError:
+                pass
+
+def _write_bytes(path: str, content: bytes) -> None:
+    with open(f'{path}.tmp', 'wb') as file:
+        file.write(content)
+    os.replace(f'{path}.tmp', path)
+
+def _save_graph() -> str:
+    from pyvis.network import Network
+    G = _create_graph()
+    for station, (x, y) in _update_layout().items():
+        if station in G:
+            G.nodes[station].update(x=x, y=y, physics=False)
     net = Network(height='1000px', width='100%', notebook=False, directed=True, cdn_resources='remote', select_menu=True)
     net.from_nx(G)
-    net.force_atlas_2based(
-        gravity=-50, 
-        central_gravity=0.01, 
-        spring_length=200,
-        spring_strength=0.08
-    )
-    net.toggle_physics(True)
-    net.save_graph(f'{HTML_PATH}.tmp.html')
-    os.replace(f'{HTML_PATH}.tmp.html', HTML_PATH)
+    net.set_edge_smooth('continuous')
+    net.toggle_physics(False)
+    return net.generate_html()
@@ -1,18 +1,49 @@
+import json
+from datetime import datetime
 from typing import Any
+from functools import lru_cache
 from django.db.models.query import QuerySet
-from django.http import HttpRequest
+from django.http import HttpRequest, JsonResponse
 from django.http.response import HttpResponse as HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.contrib.messages import get_messages
 from django.urls import reverse_lazy
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from stations.models import Station, Line
 from stations.forms import StationForm, LineForm
-from stations.utils import get_map_url
+from stations.routing import CRITERIA
+from stations.utils import get_map_url, get_map_status, get_network_version, get_network_updated_at, plan_journey
+from tickets.utils import calculate_ticket_prices
 
 # Create your views here.
 
+ROUTE_CACHE_SIZE = 4096
+ROUTE_MAX_AGE = 60
 
+
+def _station_list_cacheable(request: HttpRequest) -> bool:
+    # Staff pages embed CSRF tokens and the toggles they have just flipped, which the network version does not
+    # capture in other workers until their version check runs again
+    return not request.user.is_staff and not len(get_messages(request))
+
+def _station_list_etag(request: HttpRequest) -> str | None:
+    if not _station_list_cacheable(request):
+        return None
+    return f'stations-{get_network_version()}-{request.user.pk or 0}'
+
+def _station_list_last_modified(request: HttpRequest) -> datetime | None:
+    if not _station_list_cacheable(request):
+        return None
+    return get_network_updated_at()
+
+
+@method_decorator(cache_control(private=True, no_cache=True), name='dispatch')
+@method_decorator(condition(etag_func=_station_list_etag, last_modified_func=_station_list_last_modified), name='dispatch')
 class StationListView(generic.ListView):
     model = Station
     template_name = 'stations/station_list.html'
@@ -22,6 +53,7 @@ class StationListView(generic.ListView):
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
         context['all_lines'] = Line.objects.all()
+        context['network_version'] = get_network_version()
         return context
 
     def get_queryset(self) -> QuerySet[Any]:
@@ -35,6 +67,64 @@ class MapRedirectView(generic.RedirectView):
         return get_map_url()
 
 
+class MapStatusView(generic.View):
+    http_method_names = ['get', 'head']
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        status = get_map_status()
+        version = get_network_version()
+        status['network_version'] = version
+        status['stale'] = status.get('version') != version
+        response = JsonResponse(status)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+class RouteView(generic.View):
+    http_method_names = ['get', 'head']
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        start = request.GET.get('start')
+        stop = request.GET.get('stop')
+        criterion = request.GET.get('criterion', 'time')
+        if not start or not stop:
+            return JsonResponse({'error': 'Both start and stop stations are required.'}, status=400)
+        if criterion not in CRITERIA:
+            return JsonResponse({'error': f'Criterion must be one of: {", ".join(CRITERIA)}.'}, status=400)
+        version = get_network_version()
+        etag = f'"route-{version}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            body = _route_body(start, stop, criterion, version)
+            if body is None:
+                return JsonResponse({'error': 'No route exists between these stations.'}, status=404)
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=ROUTE_MAX_AGE)
+        return response
+
+
+@lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def _route_body(start: str, stop: str, criterion: str, version: int) -> bytes | None:
+    journey = plan_journey(start, stop, criterion)
+    if journey is None:
+        return None
+    fare, hops = calculate_ticket_prices([(start, stop)])[0]
+    return json.dumps({
+        'start': start,
+        'stop': stop,
+        'criterion': criterion,
+        'version': version,
+        'stations': [station.name for station in journey.stations],
+        'lines': list(dict.fromkeys(leg.line.name for leg in journey.legs)),
+        'legs': [{'line': leg.line.name, 'color': leg.line.color, 'stations': [station.name for station in leg.stations]} for leg in journey.legs],
+        'interchanges': journey.interchanges,
+        'travel_time': journey.travel_time,
+        'hops': hops,
+        'fare': None if fare is None else str(fare)
+    }).encode()
+
+
 class StationCreateView(LoginRequiredMixin, UserPassesTestMixin, generic.CreateView):
     model = Station
     form_class = StationForm
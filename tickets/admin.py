@@ -1,7 +1,5 @@
 from django.contrib import admin
-from django.http import HttpRequest
-from django.template.response import TemplateResponse
-from .models import Ticket, Wallet
+from .models import Ticket, Wallet, WalletTransaction, WalletSnapshot, StationFootfall, OutboundEmail
 
 # Register your models here.
 
@@ -19,10 +17,6 @@ class TicketAdmin(admin.ModelAdmin):
     search_fields = ('id', 'user__email', 'start__name', 'stop__name', 'price')
     ordering = ('-created_at', 'price')
 
-    def changelist_view(self, request: HttpRequest, extra_context: dict[str, str] | None = None) -> TemplateResponse: # type: ignore
-        Ticket.bulk_update_ticket_expiry()
-        return super().changelist_view(request, extra_context)
-
 
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
@@ -33,3 +27,55 @@ class WalletAdmin(admin.ModelAdmin):
     list_display = ('user', 'balance')
     search_fields = ('user__email',)
     ordering = ('user__email',)
+
+
+@admin.register(WalletTransaction)
+class WalletTransactionAdmin(admin.ModelAdmin):
+    list_display = ('wallet', 'kind', 'amount', 'balance_after', 'ticket', 'created_at')
+    list_select_related = ('wallet__user',)
+    list_filter = ('kind',)
+    search_fields = ('wallet__user__email', 'ticket__id')
+    ordering = ('-id',)
+
+    def has_add_permission(self, request) -> bool:
+        return False
+
+    def has_change_permission(self, request, obj=None) -> bool:
+        return False
+
+    def has_delete_permission(self, request, obj=None) -> bool:
+        return False
+
+
+@admin.register(WalletSnapshot)
+class WalletSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('wallet', 'balance', 'transaction_id', 'created_at')
+    list_select_related = ('wallet__user',)
+    search_fields = ('wallet__user__email',)
+    ordering = ('-transaction_id',)
+
+
+@admin.register(StationFootfall)
+class StationFootfallAdmin(admin.ModelAdmin):
+    fieldsets = (
+        (None, {'fields': ('station', 'day')}),
+        ('Counts', {'fields': ('tickets', 'entries', 'exits')})
+    )
+    list_display = ('station', 'day', 'tickets', 'entries', 'exits')
+    list_filter = ('day',)
+    date_hierarchy = 'day'
+    search_fields = ('station__name',)
+    ordering = ('-day', 'station')
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    fieldsets = (
+        (None, {'fields': ('recipient', 'subject', 'body')}),
+        ('Delivery', {'fields': ('created_at', 'attempts', 'next_attempt_at', 'sent_at', 'last_error')})
+    )
+    list_display = ('recipient', 'subject', 'created_at', 'attempts', 'next_attempt_at', 'sent_at')
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+    list_filter = ('sent_at',)
+    search_fields = ('recipient', 'subject')
+    ordering = ('-created_at',)
@@ -0,0 +1,31 @@
+import json
+import uuid
+import struct
+from datetime import datetime
+
+STATUS_CODES = {'ACTIVE': 0, 'IN_USE': 1, 'USED': 2, 'EXPIRED': 3}
+RECORD_HEADER = struct.Struct('>QQ16sBI')
+NAME_LENGTH = struct.Struct('>H')
+
+FEED_COLUMNS = ('change_xact', 'sequence', 'id', 'raw_status', 'created_at', 'start_id', 'stop_id')
+
+
+def encode_ndjson(xact: int, sequence: int, id: uuid.UUID, status: str, created_at: datetime, start: str, stop: str) -> bytes:
+    return json.dumps({
+        'xact': xact,
+        'seq': sequence,
+        'id': str(id),
+        'status': status,
+        'created_at': int(created_at.timestamp()),
+        'start': start,
+        'stop': stop
+    }, separators=(',', ':')).encode() + b'\n'
+
+def encode_binary(xact: int, sequence: int, id: uuid.UUID, status: str, created_at: datetime, start: str, stop: str) -> bytes:
+    start_bytes = start.encode()
+    stop_bytes = stop.encode()
+    return (
+        RECORD_HEADER.pack(xact, sequence, id.bytes, STATUS_CODES[status], int(created_at.timestamp()))
+        + NAME_LENGTH.pack(len(start_bytes)) + start_bytes
+        + NAME_LENGTH.pack(len(stop_bytes)) + stop_bytes
+    )
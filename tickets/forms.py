@@ -2,7 +2,9 @@ from decimal import Decimal
 from typing import Any
 from django import forms
 from django.core.validators import RegexValidator
-from .models import Wallet, Ticket, OTP
+from stations.snapshot import StationRecord
+from stations.utils import get_network_snapshot
+from .models import Wallet
 
 _otp_validator = RegexValidator(
     regex='^[0-9]{6}$',
@@ -10,6 +12,35 @@ _otp_validator = RegexValidator(
 )
 
 
+def _station_choices() -> list[tuple[str, str]]:
+    return [('', '---------')] + [(name, name) for name in get_network_snapshot().stations]
+
+
+class StationChoiceField(forms.ChoiceField):
+    default_error_messages = {
+        'invalid_choice': 'Select a valid station.'
+    }
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(choices=_station_choices, **kwargs)
+
+    def to_python(self, value: Any) -> StationRecord | None: # type: ignore
+        if value in self.empty_values:
+            return None
+        station = get_network_snapshot().get(str(value))
+        if station is None:
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return station
+
+    def validate(self, value: Any) -> None:
+        forms.Field.validate(self, value)
+
+
+class TicketPurchaseForm(forms.Form):
+    start = StationChoiceField()
+    stop = StationChoiceField()
+
+
 class WalletBalanceUpdateForm(forms.ModelForm):
     amount = forms.DecimalField(
         label='Amount to Add',
@@ -26,31 +57,9 @@ class WalletBalanceUpdateForm(forms.ModelForm):
         fields = []
 
 
-class TicketScanUpdateForm(forms.ModelForm):
+class TicketScanUpdateForm(forms.Form):
     ticket_id = forms.UUIDField(required=True)
-    
-    
-    class Meta:
-        model = Ticket
-        fields = []
 
-    
-    def clean(self) -> dict[str, Any]:
-        try:
-            ticket = Ticket.objects.get(id=self.cleaned_data.get('ticket_id'))
-        except Ticket.DoesNotExist:
-            raise forms.ValidationError('Ticket Does Not Exist!')
-        match ticket.status:
-            case Ticket.State.EXPIRED:
-                raise forms.ValidationError('Ticket is Expired!')
-            case Ticket.State.USED:
-                raise forms.ValidationError('Ticket has already been Used!')
-        return super().clean()
-
-
-class OTPConfirmationForm(forms.ModelForm):
-    code = forms.CharField(min_length=6, max_length=6, required=True, validators=[_otp_validator])
 
-    class Meta:
-        model = OTP
-        fields = ['code']
+class OTPConfirmationForm(forms.Form):
+    code = forms.CharField(min_length=6, max_length=6, required=True, validators=[_otp_validator])
@@ -0,0 +1,22 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from tickets.models import StationFootfall
+
+
+class Command(BaseCommand):
+    help = "Rebuilds daily per-station ticket footfall from the Ticket table for a date range."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day to rebuild (YYYY-MM-DD). Defaults to today.')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day to rebuild (YYYY-MM-DD). Defaults to today.')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        start = options['start'] or today
+        end = options['end'] or today
+        if start > end:
+            raise CommandError("--start must not be after --end.")
+        rows = StationFootfall.backfill(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} station-day footfall rows from {start} to {end}."))
+        self.stdout.write("Gate entry and exit counts are only recorded live and were left unchanged.")
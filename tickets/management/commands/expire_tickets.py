@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from tickets.models import Ticket
+
+
+class Command(BaseCommand):
+    help = "Expires ACTIVE tickets past their lifetime in bounded batches, optionally as a long-running sweeper."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Maximum tickets expired per UPDATE.')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between batches.')
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping instead of exiting once caught up.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds to wait between sweeps with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            self.sweep(options['batch_size'], options['pause'])
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def sweep(self, batch_size: int, pause: float) -> None:
+        lag = Ticket.expiry_lag()
+        total = 0
+        batches = 0
+        while True:
+            began = time.perf_counter()
+            rows = Ticket.expire_batch(batch_size)
+            if not rows:
+                break
+            total += rows
+            batches += 1
+            self.stdout.write(f"batch={batches} rows={rows} duration_ms={(time.perf_counter() - began) * 1000:.1f}")
+            time.sleep(pause)
+        self.stdout.write(f"sweep expired={total} batches={batches} lag_s={lag.total_seconds():.0f}")
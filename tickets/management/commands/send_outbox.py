@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from tickets.models import OutboundEmail
+from tickets.utils import deliver_outbox, OUTBOX_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Delivers queued e-mails from the outbox, retrying failed ones with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE, help='Maximum e-mails sent over one connection.')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting once it is drained.')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds to wait between polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            total_sent = total_failed = 0
+            while True:
+                sent, failed = deliver_outbox(options['batch_size'])
+                if not sent and not failed:
+                    break
+                total_sent += sent
+                total_failed += failed
+            self.stdout.write(f"sent={total_sent} failed={total_failed} queue_depth={OutboundEmail.queue_depth()}")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
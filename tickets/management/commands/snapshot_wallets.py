@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from tickets.models import WalletSnapshot
+
+
+class Command(BaseCommand):
+    help = "Snapshots every wallet balance that changed since the last run, optionally auditing balances against the ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--audit', action='store_true', help='Fail if any wallet balance disagrees with its snapshot plus later transactions.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Snapshotted {WalletSnapshot.take()} wallet(s).")
+        if not options['audit']:
+            return
+        mismatches = list(WalletSnapshot.audit().values_list('user__email', 'balance', 'ledger_balance'))
+        for email, balance, ledger in mismatches:
+            self.stderr.write(f"{email}: wallet balance {balance} but ledger says {ledger}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} wallet(s) disagree with the ledger.")
+        self.stdout.write(self.style.SUCCESS("All wallet balances match the ledger."))
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:28
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0003_journey_planning'),
+        ('tickets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='wallet',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=19),
+        ),
+        migrations.CreateModel(
+            name='StationFootfall',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True, verbose_name='day')),
+                ('tickets', models.PositiveIntegerField(default=0, verbose_name='tickets')),
+                ('entries', models.PositiveIntegerField(default=0, verbose_name='entries')),
+                ('exits', models.PositiveIntegerField(default=0, verbose_name='exits')),
+                ('station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='footfalls', to='stations.station', verbose_name='station')),
+            ],
+            options={
+                'verbose_name': 'Station Footfall',
+                'verbose_name_plural': 'Station Footfall',
+                'constraints': [models.UniqueConstraint(fields=('station', 'day'), name='unique_station_footfall')],
+            },
+        ),
+    ]
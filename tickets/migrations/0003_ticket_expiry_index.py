@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0003_journey_planning'),
+        ('tickets', '0002_station_footfall'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('raw_status', 'ACTIVE')), fields=['created_at'], name='ticket_active_created_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    Wallet = apps.get_model('tickets', 'Wallet')
+    WalletTransaction = apps.get_model('tickets', 'WalletTransaction')
+    WalletTransaction.objects.bulk_create([
+        WalletTransaction(wallet_id=user_id, kind='TOPUP', amount=balance, balance_after=balance)
+        for user_id, balance in Wallet.objects.exclude(balance=0).values_list('user_id', 'balance').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0005_otp_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=19, verbose_name='balance')),
+                ('transaction_id', models.PositiveBigIntegerField(verbose_name='last transaction id')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='tickets.wallet', verbose_name='wallet')),
+            ],
+            options={
+                'verbose_name': 'Wallet Snapshot',
+                'verbose_name_plural': 'Wallet Snapshots',
+                'indexes': [models.Index(fields=['wallet', '-transaction_id'], name='tickets_wal_wallet__8aa9a6_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WalletTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=19, verbose_name='amount')),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=19, verbose_name='balance after')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('kind', models.CharField(choices=[('TOPUP', 'Top-up'), ('PURCHASE', 'Purchase'), ('REFUND', 'Refund')], max_length=8, verbose_name='kind')),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='tickets.ticket', verbose_name='ticket')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='tickets.wallet', verbose_name='wallet')),
+            ],
+            options={
+                'verbose_name': 'Wallet Transaction',
+                'verbose_name_plural': 'Wallet Transactions',
+                'indexes': [models.Index(fields=['wallet', 'id'], name='tickets_wal_wallet__59293a_idx')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+NUMBER_EXISTING_TICKETS = '''
+    UPDATE tickets_ticket SET sequence = numbered.n
+    FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY created_at, id) AS n FROM tickets_ticket) AS numbered
+    WHERE tickets_ticket.id = numbered.id
+'''
+
+FORWARD_SQL = {
+    'postgresql': [
+        'CREATE SEQUENCE tickets_ticket_change_seq',
+        NUMBER_EXISTING_TICKETS,
+        "SELECT setval('tickets_ticket_change_seq', COALESCE(MAX(sequence), 0) + 1, false) FROM tickets_ticket",
+        '''
+        CREATE FUNCTION tickets_ticket_bump_sequence() RETURNS trigger AS $$
+        BEGIN
+            NEW.sequence := nextval('tickets_ticket_change_seq');
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        '''
+        CREATE TRIGGER tickets_ticket_bump_sequence BEFORE INSERT OR UPDATE ON tickets_ticket
+        FOR EACH ROW EXECUTE FUNCTION tickets_ticket_bump_sequence()
+        ''',
+    ],
+    'sqlite': [
+        NUMBER_EXISTING_TICKETS,
+        '''
+        CREATE TRIGGER tickets_ticket_sequence_insert AFTER INSERT ON tickets_ticket
+        BEGIN
+            UPDATE tickets_ticket SET sequence = (SELECT COALESCE(MAX(sequence), 0) + 1 FROM tickets_ticket) WHERE id = NEW.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER tickets_ticket_sequence_update AFTER UPDATE ON tickets_ticket
+        BEGIN
+            UPDATE tickets_ticket SET sequence = (SELECT COALESCE(MAX(sequence), 0) + 1 FROM tickets_ticket) WHERE id = NEW.id;
+        END
+        ''',
+    ],
+}
+
+REVERSE_SQL = {
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS tickets_ticket_bump_sequence ON tickets_ticket',
+        'DROP FUNCTION IF EXISTS tickets_ticket_bump_sequence()',
+        'DROP SEQUENCE IF EXISTS tickets_ticket_change_seq',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS tickets_ticket_sequence_insert',
+        'DROP TRIGGER IF EXISTS tickets_ticket_sequence_update',
+    ],
+}
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0006_wallet_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='sequence',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False, verbose_name='change sequence'),
+        ),
+        migrations.RunPython(_run(FORWARD_SQL), _run(REVERSE_SQL)),
+    ]
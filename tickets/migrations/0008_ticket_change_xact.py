@@ -0,0 +1,105 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+FORWARD_SQL = {
+    'postgresql': [
+        '''
+        CREATE OR REPLACE FUNCTION tickets_ticket_bump_sequence() RETURNS trigger AS $$
+        BEGIN
+            NEW.sequence := nextval('tickets_ticket_change_seq');
+            NEW.change_xact := pg_current_xact_id()::text::bigint;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS tickets_ticket_bump_sequence ON tickets_ticket',
+        '''
+        CREATE TRIGGER tickets_ticket_bump_sequence BEFORE INSERT OR UPDATE ON tickets_ticket
+        FOR EACH ROW EXECUTE FUNCTION tickets_ticket_bump_sequence()
+        ''',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS tickets_ticket_sequence_insert',
+        'DROP TRIGGER IF EXISTS tickets_ticket_sequence_update',
+        '''
+        CREATE TRIGGER tickets_ticket_sequence_insert AFTER INSERT ON tickets_ticket
+        BEGIN
+            UPDATE tickets_ticket SET
+                sequence = (SELECT COALESCE(MAX(sequence), 0) + 1 FROM tickets_ticket),
+                change_xact = (SELECT COALESCE(MAX(sequence), 0) + 1 FROM tickets_ticket)
+            WHERE id = NEW.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER tickets_ticket_sequence_update AFTER UPDATE ON tickets_ticket
+        BEGIN
+            UPDATE tickets_ticket SET
+                sequence = (SELECT COALESCE(MAX(sequence), 0) + 1 FROM tickets_ticket),
+                change_xact = (SELECT COALESCE(MAX(sequence), 0) + 1 FROM tickets_ticket)
+            WHERE id = NEW.id;
+        END
+        ''',
+    ],
+}
+
+REVERSE_SQL = {
+    'postgresql': [
+        '''
+        CREATE OR REPLACE FUNCTION tickets_ticket_bump_sequence() RETURNS trigger AS $$
+        BEGIN
+            NEW.sequence := nextval('tickets_ticket_change_seq');
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS tickets_ticket_sequence_insert',
+        'DROP TRIGGER IF EXISTS tickets_ticket_sequence_update',
+        '''
+        CREATE TRIGGER tickets_ticket_sequence_insert AFTER INSERT ON tickets_ticket
+        BEGIN
+            UPDATE tickets_ticket SET sequence = (SELECT COALESCE(MAX(sequence), 0) + 1 FROM tickets_ticket) WHERE id = NEW.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER tickets_ticket_sequence_update AFTER UPDATE ON tickets_ticket
+        BEGIN
+            UPDATE tickets_ticket SET sequence = (SELECT COALESCE(MAX(sequence), 0) + 1 FROM tickets_ticket) WHERE id = NEW.id;
+        END
+        ''',
+    ],
+}
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0007_ticket_change_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='change_xact',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='change transaction'),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='sequence',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='change sequence'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['change_xact', 'sequence'], name='ticket_change_feed_idx'),
+        ),
+        migrations.RunPython(_run(FORWARD_SQL), _run(REVERSE_SQL)),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0003_journey_planning'),
+        ('tickets', '0008_ticket_change_xact'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='tickets_tic_user_id_064b1b_idx'),
+        ),
+    ]
@@ -1,14 +1,24 @@
 import uuid
 from decimal import Decimal
-from datetime import timedelta
-from django.db import models
+from collections import Counter
+from functools import partial
+from datetime import date, datetime, time, timedelta
+from typing import Iterable
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce, TruncDate
 from django.utils import timezone
 from django.conf import settings
 from django.contrib import admin
 from django.db.models import F
+from config.instrumentation import section
+from config.metrics import TICKET_SCANS, WALLET_DEBIT_CONFLICTS
+from .tokens import make_ticket_token
 
 # Create your models here.
 
+TICKET_LIFETIME = timedelta(days=2)
+OTP_LIFETIME = timedelta(minutes=5)
+
 
 class Ticket(models.Model):
     id = models.UUIDField(verbose_name='id', unique=True, primary_key=True, default=uuid.uuid4, editable=False)
@@ -17,6 +27,8 @@ class Ticket(models.Model):
     user = models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tickets', null=True)
     created_at = models.DateTimeField(verbose_name='created at', auto_now_add=True)
     price = models.DecimalField(verbose_name='price', max_digits=11, decimal_places=2)
+    sequence = models.PositiveBigIntegerField(verbose_name='change sequence', default=0, editable=False)
+    change_xact = models.PositiveBigIntegerField(verbose_name='change transaction', default=0, editable=False)
 
 
     class Meta:
@@ -24,7 +36,10 @@ class Ticket(models.Model):
         verbose_name_plural = 'Tickets'
         indexes = [
             models.Index(fields=['raw_status', 'created_at']),
-            models.Index(fields=['user', 'raw_status', '-created_at'])
+            models.Index(fields=['user', 'raw_status', '-created_at']),
+            models.Index(fields=['user', '-created_at', '-id']),
+            models.Index(fields=['created_at'], condition=models.Q(raw_status='ACTIVE'), name='ticket_active_created_idx'),
+            models.Index(fields=['change_xact', 'sequence'], name='ticket_change_feed_idx')
         ]
 
 
@@ -37,6 +52,16 @@ class Ticket(models.Model):
 
     raw_status = models.CharField(verbose_name='status', max_length=11, choices=State.choices, default=State.ACTIVE, db_index=True)
 
+
+    class Scan(models.TextChoices):
+        ENTERED = 'entered', 'Entered'
+        EXITED = 'exited', 'Exited'
+        USED = 'used', 'Already Used'
+        EXPIRED = 'expired', 'Expired'
+        NOT_FOUND = 'not_found', 'Not Found'
+        CONFLICT = 'conflict', 'Conflict'
+
+
     @property
     @admin.display(
         ordering='-created_at',
@@ -51,18 +76,116 @@ class Ticket(models.Model):
         if self.raw_status in (Ticket.State.USED, Ticket.State.IN_USE):
             return False
         else:
-            expiry = self.created_at + timedelta(days=2)
+            expiry = self.created_at + TICKET_LIFETIME
             return timezone.now() > expiry
 
+    @property
+    def token(self) -> str:
+        return make_ticket_token(self.id, self.start_id, self.stop_id, self.created_at, self.created_at + TICKET_LIFETIME) # type: ignore
+
+    def save(self, *args, **kwargs) -> None:
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            # Counted after commit, so a purchase does not hold the busiest (station, day) rows locked while it finishes
+            transaction.on_commit(partial(StationFootfall.record, 'tickets', {self.start_id, self.stop_id}, timezone.localdate(self.created_at))) # type: ignore
+
     def __str__(self) -> str:
         return str(self.id)
     
     @classmethod
-    def bulk_update_ticket_expiry(cls) -> None:
-        cls.objects.filter(
+    def scan(cls, scanned: Iterable[uuid.UUID]) -> list[str]:
+        scanned = list(scanned)
+        ids = list(dict.fromkeys(scanned))
+        if not ids:
+            return []
+        with transaction.atomic():
+            exited = cls._transition(ids, cls.State.IN_USE, cls.State.USED, 'stop_id')
+            entered = cls._transition([pk for pk in ids if pk not in exited], cls.State.ACTIVE, cls.State.IN_USE, 'start_id', timezone.now() - TICKET_LIFETIME)
+            StationFootfall.record('entries', entered.values())
+            StationFootfall.record('exits', exited.values())
+        outcomes = dict.fromkeys(exited, cls.Scan.EXITED) | dict.fromkeys(entered, cls.Scan.ENTERED)
+        remaining = [pk for pk in ids if pk not in outcomes]
+        stale = timezone.now() - TICKET_LIFETIME
+        for pk, status, created_at in cls.objects.filter(pk__in=remaining).values_list('pk', 'raw_status', 'created_at'):
+            if status == cls.State.USED:
+                outcomes[pk] = cls.Scan.USED
+            elif status == cls.State.EXPIRED or (status == cls.State.ACTIVE and created_at < stale):
+                outcomes[pk] = cls.Scan.EXPIRED
+            else:
+                outcomes[pk] = cls.Scan.CONFLICT
+        # Only the first scan of a ticket in a batch moves it on; repeats see the state that scan left behind
+        repeats = {cls.Scan.ENTERED: cls.Scan.CONFLICT, cls.Scan.EXITED: cls.Scan.USED}
+        results = []
+        seen = set()
+        for pk in scanned:
+            outcome = outcomes.get(pk, cls.Scan.NOT_FOUND)
+            results.append(repeats.get(outcome, outcome) if pk in seen else outcome)
+            seen.add(pk)
+        for outcome, count in Counter(results).items():
+            TICKET_SCANS.labels(outcome).inc(count)
+        return results
+
+    @classmethod
+    def _transition(cls, ids: list[uuid.UUID], source: str, target: str, column: str, created_after: datetime | None = None) -> dict[uuid.UUID, str]:
+        if not ids:
+            return {}
+        pk = cls._meta.pk
+        quote = connection.ops.quote_name
+        sql = f'UPDATE {quote(cls._meta.db_table)} SET raw_status = %s WHERE raw_status = %s AND id IN ({", ".join(["%s"] * len(ids))})'
+        params = [target, source] + [pk.get_db_prep_value(i, connection) for i in ids] # type: ignore
+        if created_after is not None:
+            sql += ' AND created_at >= %s'
+            params.append(cls._meta.get_field('created_at').get_db_prep_value(created_after, connection))
+        with connection.cursor() as cursor:
+            cursor.execute(f'{sql} RETURNING id, {quote(column)}', params)
+            return {pk.to_python(row[0]): row[1] for row in cursor.fetchall()} # type: ignore
+
+    @classmethod
+    def change_watermark(cls) -> int:
+        # Transactions older than the oldest one still running have all finished, so nothing they wrote can still
+        # appear; SQLite has a single writer, so everything it has committed is already final
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+                return cursor.fetchone()[0]
+        return (cls.objects.aggregate(head=models.Max('change_xact'))['head'] or 0) + 1
+
+    @classmethod
+    def changes(cls, xact: int, sequence: int, watermark: int) -> models.QuerySet:
+        return cls.objects.filter(
+            models.Q(change_xact__gt=xact) | models.Q(change_xact=xact, sequence__gt=sequence),
+            change_xact__lt=watermark
+        ).order_by('change_xact', 'sequence')
+
+    @classmethod
+    def revoked_ids(cls) -> list[uuid.UUID]:
+        return list(cls.objects.filter(
+            raw_status__in=[cls.State.IN_USE, cls.State.USED],
+            created_at__gte=timezone.now() - TICKET_LIFETIME
+        ).values_list('id', flat=True).iterator(chunk_size=10000))
+
+    @classmethod
+    def expire_batch(cls, batch_size: int) -> int:
+        with transaction.atomic():
+            ids = list(cls.objects.select_for_update(skip_locked=True).filter(
+                raw_status=cls.State.ACTIVE,
+                created_at__lt=timezone.now() - TICKET_LIFETIME
+            ).order_by('created_at').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return 0
+            return cls.objects.filter(pk__in=ids, raw_status=cls.State.ACTIVE).update(raw_status=cls.State.EXPIRED)
+
+    @classmethod
+    def expiry_lag(cls) -> timedelta:
+        now = timezone.now()
+        oldest = cls.objects.filter(
             raw_status=cls.State.ACTIVE,
-            created_at__lt=timezone.now() - timedelta(days=2)
-        ).update(raw_status=cls.State.EXPIRED)
+            created_at__lt=now - TICKET_LIFETIME
+        ).order_by('created_at').values_list('created_at', flat=True).first()
+        if oldest is None:
+            return timedelta(0)
+        return now - (oldest + TICKET_LIFETIME)
     
 
 class Wallet(models.Model):
@@ -75,24 +198,144 @@ class Wallet(models.Model):
         verbose_name_plural = 'Wallets'
 
 
-    def deduct(self, amount: Decimal):
-        success = bool(Wallet.objects.filter(pk=self.pk, balance__gte=amount).update(balance = F('balance') - amount))
-        self.refresh_from_db()
-        return success
+    def deduct(self, amount: Decimal, kind: str = 'PURCHASE', ticket_id: uuid.UUID | None = None) -> bool:
+        balance = Wallet.debit(self.pk, amount, kind, ticket_id)
+        if balance is None:
+            return False
+        self.balance = balance
+        return True
+
+    def add(self, amount: Decimal, kind: str = 'TOPUP', ticket_id: uuid.UUID | None = None) -> bool:
+        balance = Wallet.credit(self.pk, amount, kind, ticket_id)
+        if balance is None:
+            return False
+        self.balance = balance
+        return True
+
+    @classmethod
+    def debit(cls, user_id: int, amount: Decimal, kind: str = 'PURCHASE', ticket_id: uuid.UUID | None = None) -> Decimal | None:
+        return cls._apply(user_id, -amount, kind, ticket_id)
+
+    @classmethod
+    def credit(cls, user_id: int, amount: Decimal, kind: str = 'TOPUP', ticket_id: uuid.UUID | None = None) -> Decimal | None:
+        return cls._apply(user_id, amount, kind, ticket_id)
 
-    def add(self, amount: Decimal) -> bool:
-        success = bool(Wallet.objects.filter(pk=self.pk).update(balance = F('balance') + amount))
-        self.refresh_from_db()
-        return success
+    @classmethod
+    def _apply(cls, user_id: int, amount: Decimal, kind: str, ticket_id: uuid.UUID | None) -> Decimal | None:
+        quote = connection.ops.quote_name
+        table = quote(cls._meta.db_table)
+        update = f'UPDATE {table} SET balance = balance + %s WHERE user_id = %s AND balance + %s >= 0'
+        params = [amount, user_id, amount]
+        # PostgreSQL writes the balance change and its ledger row in one statement; SQLite cannot put an UPDATE in a CTE
+        combined = connection.vendor == 'postgresql'
+        # Callers already hold a transaction for the purchase, so a savepoint would only add round trips
+        with section('wallet'), transaction.atomic(savepoint=False), connection.cursor() as cursor:
+            if combined:
+                ledger = WalletTransaction._meta
+                cursor.execute(
+                    f'WITH changed AS ({update} RETURNING user_id, balance) '
+                    f'INSERT INTO {quote(ledger.db_table)} (wallet_id, kind, amount, balance_after, ticket_id, created_at) '
+                    f'SELECT user_id, %s, %s, balance, %s, %s FROM changed RETURNING balance_after',
+                    params + [
+                        kind,
+                        amount,
+                        ledger.get_field('ticket').get_db_prep_value(ticket_id, connection), # type: ignore
+                        ledger.get_field('created_at').get_db_prep_value(timezone.now(), connection)
+                    ]
+                )
+            else:
+                cursor.execute(f'{update} RETURNING balance', params)
+            row = cursor.fetchone()
+            if row is None:
+                if amount < 0:
+                    WALLET_DEBIT_CONFLICTS.inc()
+                return None
+            balance = cls._meta.get_field('balance').to_python(row[0]).quantize(Decimal('0.01'))
+            if not combined:
+                WalletTransaction.objects.create(wallet_id=user_id, kind=kind, amount=amount, balance_after=balance, ticket_id=ticket_id)
+        return balance
 
     def __str__(self) -> str:
         return str(self.user)
     
 
+class WalletTransaction(models.Model):
+    wallet = models.ForeignKey(to='tickets.Wallet', on_delete=models.CASCADE, related_name='transactions', verbose_name='wallet')
+    amount = models.DecimalField(verbose_name='amount', max_digits=19, decimal_places=2)
+    balance_after = models.DecimalField(verbose_name='balance after', max_digits=19, decimal_places=2)
+    ticket = models.ForeignKey(to='tickets.Ticket', on_delete=models.SET_NULL, related_name='transactions', verbose_name='ticket', null=True, blank=True)
+    created_at = models.DateTimeField(verbose_name='created at', auto_now_add=True)
+
+
+    class Meta:
+        verbose_name = 'Wallet Transaction'
+        verbose_name_plural = 'Wallet Transactions'
+        indexes = [
+            models.Index(fields=['wallet', 'id'])
+        ]
+
+
+    class Kind(models.TextChoices):
+        TOPUP = 'TOPUP', 'Top-up'
+        PURCHASE = 'PURCHASE', 'Purchase'
+        REFUND = 'REFUND', 'Refund'
+
+
+    kind = models.CharField(verbose_name='kind', max_length=8, choices=Kind.choices)
+
+    def __str__(self) -> str:
+        return f'{self.kind} {self.amount} ({self.wallet_id})' # type: ignore
+
+
+class WalletSnapshot(models.Model):
+    wallet = models.ForeignKey(to='tickets.Wallet', on_delete=models.CASCADE, related_name='snapshots', verbose_name='wallet')
+    balance = models.DecimalField(verbose_name='balance', max_digits=19, decimal_places=2)
+    transaction_id = models.PositiveBigIntegerField(verbose_name='last transaction id')
+    created_at = models.DateTimeField(verbose_name='created at', auto_now_add=True)
+
+
+    class Meta:
+        verbose_name = 'Wallet Snapshot'
+        verbose_name_plural = 'Wallet Snapshots'
+        indexes = [
+            models.Index(fields=['wallet', '-transaction_id'])
+        ]
+
+
+    @classmethod
+    def take(cls) -> int:
+        watermark = cls.objects.aggregate(watermark=models.Max('transaction_id'))['watermark'] or 0
+        latest = WalletTransaction.objects.filter(id__gt=watermark).values('wallet').annotate(last=models.Max('id')).values_list('last', flat=True)
+        snapshots = [
+            cls(wallet_id=wallet, balance=balance, transaction_id=pk)
+            for pk, wallet, balance in WalletTransaction.objects.filter(id__in=latest).values_list('id', 'wallet', 'balance_after')
+        ]
+        cls.objects.bulk_create(snapshots)
+        return len(snapshots)
+
+    @classmethod
+    def audit(cls) -> models.QuerySet:
+        latest = cls.objects.filter(wallet=models.OuterRef('pk')).order_by('-transaction_id')
+        since = WalletTransaction.objects.filter(
+            wallet=models.OuterRef('pk'),
+            id__gt=models.OuterRef('snapshot_transaction')
+        ).values('wallet').annotate(total=models.Sum('amount')).values('total')
+        return Wallet.objects.annotate(
+            snapshot_balance=Coalesce(models.Subquery(latest.values('balance')[:1]), Decimal(0), output_field=models.DecimalField()),
+            snapshot_transaction=Coalesce(models.Subquery(latest.values('transaction_id')[:1]), 0)
+        ).annotate(
+            ledger_balance=F('snapshot_balance') + Coalesce(models.Subquery(since), Decimal(0), output_field=models.DecimalField())
+        ).exclude(balance=F('ledger_balance'))
+
+    def __str__(self) -> str:
+        return f'{self.wallet_id} at {self.transaction_id}' # type: ignore
+
+
 class OTP(models.Model):
     user = models.OneToOneField(to=settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='otp', primary_key=True)
     code = models.CharField(max_length=6, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(verbose_name='attempts', default=0)
 
     class Meta:
         verbose_name = 'OTP'
@@ -100,8 +343,109 @@ class OTP(models.Model):
 
 
     def expired(self) -> bool:
-        expiry = self.created_at + timedelta(minutes=5)
+        expiry = self.created_at + OTP_LIFETIME
         return timezone.now() > expiry
     
     def __str__(self) -> str:
         return self.code
+
+
+class StationFootfall(models.Model):
+    station = models.ForeignKey(to='stations.Station', on_delete=models.CASCADE, related_name='footfalls', verbose_name='station')
+    day = models.DateField(verbose_name='day', db_index=True)
+    tickets = models.PositiveIntegerField(verbose_name='tickets', default=0)
+    entries = models.PositiveIntegerField(verbose_name='entries', default=0)
+    exits = models.PositiveIntegerField(verbose_name='exits', default=0)
+
+
+    class Meta:
+        verbose_name = 'Station Footfall'
+        verbose_name_plural = 'Station Footfall'
+        constraints = [
+            models.UniqueConstraint(fields=['station', 'day'], name='unique_station_footfall')
+        ]
+
+
+    @classmethod
+    def record(cls, field: str, stations: Iterable[str], day: date | None = None) -> None:
+        counts = Counter(stations)
+        if not counts:
+            return
+        quote = connection.ops.quote_name
+        table = quote(cls._meta.db_table)
+        column = quote(cls._meta.get_field(field).column)
+        day = cls._meta.get_field('day').get_db_prep_value(day or timezone.localdate(), connection)
+        tallies = ('tickets', 'entries', 'exits')
+        # One upsert for every station, in a fixed order so concurrent recorders cannot deadlock
+        rows = [[station, day] + [counts[station] if tally == field else 0 for tally in tallies] for station in sorted(counts)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (station_id, day, {", ".join(map(quote, tallies))}) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))} '
+                f'ON CONFLICT (station_id, day) DO UPDATE SET {column} = {table}.{column} + EXCLUDED.{column}',
+                [value for row in rows for value in row]
+            )
+
+    @classmethod
+    def between(cls, start: date, end: date) -> models.QuerySet:
+        return cls.objects.filter(day__range=(start, end)).values('station').annotate(
+            tickets=models.Sum('tickets'),
+            entries=models.Sum('entries'),
+            exits=models.Sum('exits')
+        ).order_by('station')
+
+    @classmethod
+    def backfill(cls, start: date, end: date) -> int:
+        tz = timezone.get_current_timezone()
+        tickets = Ticket.objects.filter(
+            created_at__gte=datetime.combine(start, time.min, tzinfo=tz),
+            created_at__lt=datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz)
+        ).annotate(day=TruncDate('created_at'))
+        counts: Counter[tuple[str, date]] = Counter()
+        for row in tickets.values('day', 'start').annotate(count=models.Count('id')):
+            counts[row['start'], row['day']] += row['count']
+        for row in tickets.exclude(stop=F('start')).values('day', 'stop').annotate(count=models.Count('id')):
+            counts[row['stop'], row['day']] += row['count']
+        with transaction.atomic():
+            cls.objects.filter(day__range=(start, end)).update(tickets=0)
+            cls.objects.bulk_create(
+                [cls(station_id=station, day=day, tickets=count) for (station, day), count in counts.items()],
+                update_conflicts=True,
+                unique_fields=['station', 'day'],
+                update_fields=['tickets']
+            )
+        return len(counts)
+
+    def __str__(self) -> str:
+        return f'{self.station_id} on {self.day}' # type: ignore
+
+
+class OutboundEmail(models.Model):
+    recipient = models.EmailField(verbose_name='recipient')
+    subject = models.CharField(verbose_name='subject', max_length=255)
+    body = models.TextField(verbose_name='body')
+    created_at = models.DateTimeField(verbose_name='created at', auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(verbose_name='attempts', default=0)
+    next_attempt_at = models.DateTimeField(verbose_name='next attempt at', default=timezone.now, null=True)
+    sent_at = models.DateTimeField(verbose_name='sent at', null=True, blank=True)
+    last_error = models.TextField(verbose_name='last error', blank=True)
+
+
+    class Meta:
+        verbose_name = 'Outbound Email'
+        verbose_name_plural = 'Outbound Emails'
+        indexes = [
+            models.Index(fields=['next_attempt_at'], condition=models.Q(sent_at__isnull=True), name='outbound_email_pending_idx')
+        ]
+
+
+    @classmethod
+    def pending(cls) -> models.QuerySet:
+        return cls.objects.filter(sent_at__isnull=True, next_attempt_at__isnull=False)
+
+    @classmethod
+    def queue_depth(cls) -> int:
+        return cls.pending().count()
+
+    def __str__(self) -> str:
+        return f'{self.subject} to {self.recipient}'
@@ -0,0 +1,101 @@
+import enum
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import OTP, OTP_LIFETIME
+from .utils import generate_otp
+
+MAX_OTP_ATTEMPTS = 5
+
+
+class OTPStatus(enum.Enum):
+    VALID = 'valid'
+    INVALID = 'invalid'
+    LOCKED = 'locked'
+
+
+class BaseOTPBackend:
+
+    def issue(self, user_id: int) -> str:
+        raise NotImplementedError
+
+    def verify(self, user_id: int, code: str) -> OTPStatus:
+        raise NotImplementedError
+
+
+class DatabaseOTPBackend(BaseOTPBackend):
+
+    def issue(self, user_id: int) -> str:
+        code = generate_otp()
+        OTP.objects.update_or_create(user_id=user_id, defaults={'code': code, 'created_at': timezone.now(), 'attempts': 0})
+        return code
+
+    def verify(self, user_id: int, code: str) -> OTPStatus:
+        deleted, _ = OTP.objects.filter(
+            user_id=user_id,
+            code=code,
+            created_at__gte=timezone.now() - OTP_LIFETIME,
+            attempts__lt=MAX_OTP_ATTEMPTS
+        ).delete()
+        if deleted:
+            return OTPStatus.VALID
+        if OTP.objects.filter(user_id=user_id, attempts__lt=MAX_OTP_ATTEMPTS - 1).update(attempts=F('attempts') + 1):
+            return OTPStatus.INVALID
+        if OTP.objects.filter(user_id=user_id).update(attempts=MAX_OTP_ATTEMPTS):
+            return OTPStatus.LOCKED
+        return OTPStatus.INVALID
+
+
+class CacheOTPBackend(BaseOTPBackend):
+
+    def __init__(self, alias: str = 'default') -> None:
+        self.cache = caches[alias]
+        self.timeout = int(OTP_LIFETIME.total_seconds())
+
+    def issue(self, user_id: int) -> str:
+        code = generate_otp()
+        previous = self.cache.get(self._current_key(user_id))
+        if previous is not None:
+            self.cache.delete(self._code_key(user_id, previous))
+        self.cache.set_many({
+            self._code_key(user_id, code): True,
+            self._current_key(user_id): code,
+            self._attempts_key(user_id): 0
+        }, self.timeout)
+        return code
+
+    def verify(self, user_id: int, code: str) -> OTPStatus:
+        # delete() alone would also remove a code that has expired but not yet been evicted
+        if self.cache.get(self._code_key(user_id, code)) and self.cache.delete(self._code_key(user_id, code)):
+            return OTPStatus.VALID
+        key = self._attempts_key(user_id)
+        self.cache.add(key, 0, self.timeout)
+        try:
+            attempts = self.cache.incr(key)
+        except ValueError:
+            # The counter expired between add() and incr(), so this is the first attempt of a fresh window
+            self.cache.add(key, 1, self.timeout)
+            attempts = 1
+        if attempts < MAX_OTP_ATTEMPTS:
+            return OTPStatus.INVALID
+        current = self.cache.get(self._current_key(user_id))
+        if current is not None:
+            self.cache.delete(self._code_key(user_id, current))
+        return OTPStatus.LOCKED
+
+    def _code_key(self, user_id: int, code: str) -> str:
+        return f'otp:{user_id}:{code}'
+
+    def _current_key(self, user_id: int) -> str:
+        return f'otp:{user_id}'
+
+    def _attempts_key(self, user_id: int) -> str:
+        return f'otp-attempts:{user_id}'
+
+
+@lru_cache(maxsize=None)
+def get_otp_backend() -> BaseOTPBackend:
+    return import_string(settings.OTP_BACKEND)()
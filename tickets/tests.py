@@ -1,3 +1,271 @@
-from django.test import TestCase
+import json
+import time
+import uuid
+import base64
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from unittest import mock
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from config.metrics import TICKET_SCANS
+from stations.models import Station
+from .models import Ticket, Wallet, WalletSnapshot, WalletTransaction, OTP, StationFootfall, TICKET_LIFETIME
+from .otp import CacheOTPBackend, DatabaseOTPBackend, OTPStatus, MAX_OTP_ATTEMPTS
+from .feed import RECORD_HEADER, NAME_LENGTH, encode_binary
+from .tokens import HEADER, make_ticket_token, read_ticket_token, _sign
 
 # Create your tests here.
+
+
+class TicketScanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.start = Station.objects.create(name='Alpha')
+        cls.stop = Station.objects.create(name='Beta')
+
+    def _ticket(self, **kwargs) -> Ticket:
+        return Ticket.objects.create(start=self.start, stop=self.stop, price=Decimal('10.00'), **kwargs)
+
+    def _scans(self) -> dict[str, float]:
+        return {outcome: TICKET_SCANS.labels(outcome)._value.get() for outcome in Ticket.Scan.values}
+
+    def test_scan_moves_a_ticket_through_its_states(self) -> None:
+        ticket = self._ticket()
+        self.assertEqual(Ticket.scan([ticket.pk]), [Ticket.Scan.ENTERED])
+        self.assertEqual(Ticket.scan([ticket.pk]), [Ticket.Scan.EXITED])
+        self.assertEqual(Ticket.scan([ticket.pk]), [Ticket.Scan.USED])
+        self.assertEqual(Ticket.scan([uuid.uuid4()]), [Ticket.Scan.NOT_FOUND])
+
+    def test_scan_reports_stale_tickets_as_expired(self) -> None:
+        ticket = self._ticket()
+        Ticket.objects.filter(pk=ticket.pk).update(created_at=timezone.now() - TICKET_LIFETIME - timedelta(minutes=1))
+        self.assertEqual(Ticket.scan([ticket.pk]), [Ticket.Scan.EXPIRED])
+        self.assertEqual(Ticket.objects.get(pk=ticket.pk).raw_status, Ticket.State.ACTIVE)
+
+    def test_repeated_ticket_in_a_batch_only_counts_once(self) -> None:
+        entering = self._ticket()
+        exiting = self._ticket(raw_status=Ticket.State.IN_USE)
+        before = self._scans()
+        outcomes = Ticket.scan([entering.pk, exiting.pk, entering.pk, exiting.pk, entering.pk])
+        self.assertEqual(outcomes, [Ticket.Scan.ENTERED, Ticket.Scan.EXITED, Ticket.Scan.CONFLICT, Ticket.Scan.USED, Ticket.Scan.CONFLICT])
+        after = self._scans()
+        self.assertEqual(after[Ticket.Scan.ENTERED] - before[Ticket.Scan.ENTERED], 1)
+        self.assertEqual(after[Ticket.Scan.CONFLICT] - before[Ticket.Scan.CONFLICT], 2)
+
+    def test_batch_view_matches_duplicates_across_formats(self) -> None:
+        user = get_user_model().objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.client.force_login(user)
+        ticket = self._ticket()
+        tickets = [str(ticket.pk), str(ticket.pk).upper(), ticket.token, 'nonsense']
+        response = self.client.post('/tickets/scanner/scan/batch/', {'tickets': tickets}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([result['outcome'] for result in body['results']], ['entered', 'conflict', 'conflict', 'invalid'])
+        self.assertEqual(body['counts'], {'entered': 1, 'conflict': 2, 'invalid': 1})
+
+    def test_batch_view_requires_the_csrf_token_header(self) -> None:
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(get_user_model().objects.create_user('gate', 'gate@example.com', 'password', is_staff=True))
+        ticket = self._ticket()
+        body = {'tickets': [str(ticket.pk)]}
+        self.assertEqual(client.post('/tickets/scanner/scan/batch/', body, content_type='application/json').status_code, 403)
+        # Any scanner page hands out the cookie; the controller echoes it in the header on every batch
+        token = client.get('/tickets/scanner/scan/').cookies['csrftoken'].value
+        response = client.post('/tickets/scanner/scan/batch/', body, content_type='application/json', headers={'X-CSRFToken': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['counts'], {'entered': 1})
+
+
+class StationFootfallTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.start = Station.objects.create(name='Alpha')
+        cls.stop = Station.objects.create(name='Beta')
+
+    def _footfall(self) -> dict[str, tuple[int, int, int]]:
+        return {row[0]: row[1:] for row in StationFootfall.objects.values_list('station', 'tickets', 'entries', 'exits')}
+
+    def test_purchases_are_counted_after_commit(self) -> None:
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Ticket.objects.create(start=self.start, stop=self.stop, price=Decimal('10.00'))
+            self.assertEqual(self._footfall(), {})
+        self.assertEqual(len(callbacks), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.create(start=self.start, stop=self.start, price=Decimal('10.00'))
+        self.assertEqual(self._footfall(), {'Alpha': (2, 0, 0), 'Beta': (1, 0, 0)})
+
+    def test_scans_add_to_existing_rows(self) -> None:
+        tickets = [Ticket.objects.create(start=self.start, stop=self.stop, price=Decimal('10.00')) for _ in range(2)]
+        Ticket.scan([ticket.pk for ticket in tickets])
+        Ticket.scan([tickets[0].pk])
+        self.assertEqual(self._footfall(), {'Alpha': (0, 2, 0), 'Beta': (0, 0, 1)})
+
+
+class WalletLedgerTests(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user('rider', 'rider@example.com', 'password')
+        self.wallet = Wallet.objects.create(user=self.user)
+
+    def test_every_balance_change_is_recorded(self) -> None:
+        self.assertTrue(self.wallet.add(Decimal('50.00')))
+        self.assertTrue(self.wallet.deduct(Decimal('20.00')))
+        self.assertFalse(self.wallet.deduct(Decimal('100.00')))
+        self.assertEqual(self.wallet.balance, Decimal('30.00'))
+        self.assertEqual(Wallet.objects.get(pk=self.user.pk).balance, Decimal('30.00'))
+        self.assertEqual(
+            list(WalletTransaction.objects.filter(wallet=self.wallet).order_by('id').values_list('kind', 'amount', 'balance_after')),
+            [('TOPUP', Decimal('50.00'), Decimal('50.00')), ('PURCHASE', Decimal('-20.00'), Decimal('30.00'))]
+        )
+
+    def test_audit_finds_balances_that_disagree_with_the_ledger(self) -> None:
+        self.wallet.add(Decimal('40.00'))
+        self.assertEqual(WalletSnapshot.take(), 1)
+        self.wallet.deduct(Decimal('15.00'))
+        self.assertFalse(WalletSnapshot.audit().exists())
+        Wallet.objects.filter(pk=self.user.pk).update(balance=Decimal('99.00'))
+        self.assertEqual(list(WalletSnapshot.audit().values_list('pk', flat=True)), [self.user.pk])
+
+
+class OTPTests(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user('rider', 'rider@example.com', 'password')
+        self.backend = DatabaseOTPBackend()
+
+    def test_code_is_single_use(self) -> None:
+        code = self.backend.issue(self.user.pk)
+        self.assertEqual(self.backend.verify(self.user.pk, code), OTPStatus.VALID)
+        self.assertEqual(self.backend.verify(self.user.pk, code), OTPStatus.INVALID)
+
+    def test_expired_code_is_rejected(self) -> None:
+        code = self.backend.issue(self.user.pk)
+        OTP.objects.filter(user=self.user).update(created_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.backend.verify(self.user.pk, code), OTPStatus.INVALID)
+
+    def test_too_many_attempts_lock_the_code(self) -> None:
+        code = self.backend.issue(self.user.pk)
+        wrong = '000000' if code != '000000' else '111111'
+        statuses = [self.backend.verify(self.user.pk, wrong) for _ in range(MAX_OTP_ATTEMPTS)]
+        self.assertEqual(statuses[-1], OTPStatus.LOCKED)
+        self.assertEqual(self.backend.verify(self.user.pk, code), OTPStatus.LOCKED)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'otp-tests'}})
+class CacheOTPTests(TestCase):
+
+    def setUp(self) -> None:
+        self.backend = CacheOTPBackend()
+        self.backend.cache.clear()
+
+    def test_code_is_single_use(self) -> None:
+        code = self.backend.issue(1)
+        self.assertEqual(self.backend.verify(1, code), OTPStatus.VALID)
+        self.assertEqual(self.backend.verify(1, code), OTPStatus.INVALID)
+
+    def test_new_code_replaces_the_old_one(self) -> None:
+        old = self.backend.issue(1)
+        new = self.backend.issue(1)
+        if old != new:
+            self.assertEqual(self.backend.verify(1, old), OTPStatus.INVALID)
+        self.assertEqual(self.backend.verify(1, new), OTPStatus.VALID)
+
+    def test_expired_code_is_rejected(self) -> None:
+        code = self.backend.issue(1)
+        later = time.time() + self.backend.timeout + 1
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(self.backend.verify(1, code), OTPStatus.INVALID)
+
+    def test_too_many_attempts_lock_the_code(self) -> None:
+        code = self.backend.issue(1)
+        wrong = '000000' if code != '000000' else '111111'
+        statuses = [self.backend.verify(1, wrong) for _ in range(MAX_OTP_ATTEMPTS)]
+        self.assertEqual(statuses, [OTPStatus.INVALID] * (MAX_OTP_ATTEMPTS - 1) + [OTPStatus.LOCKED])
+        self.assertEqual(self.backend.verify(1, code), OTPStatus.LOCKED)
+
+    def test_attempt_counter_expiring_mid_verify_is_restarted(self) -> None:
+        self.backend.issue(1)
+        key = self.backend._attempts_key(1)
+
+        def expire(*args, **kwargs):
+            self.backend.cache.delete(key)
+            raise ValueError
+
+        with mock.patch.object(self.backend.cache, 'incr', side_effect=expire):
+            self.assertEqual(self.backend.verify(1, 'nope'), OTPStatus.INVALID)
+        self.assertEqual(self.backend.cache.get(key), 1)
+
+
+class TicketTokenTests(TestCase):
+
+    def test_token_round_trip(self) -> None:
+        now = timezone.now().replace(microsecond=0)
+        id = uuid.uuid4()
+        claims = read_ticket_token(make_ticket_token(id, 'Alpha', 'Βήτα', now, now + TICKET_LIFETIME))
+        self.assertIsNotNone(claims)
+        self.assertEqual((claims.id, claims.start, claims.stop, claims.created_at), (id, 'Alpha', 'Βήτα', now))
+        self.assertFalse(claims.expired(now))
+
+    def test_tampered_token_is_rejected(self) -> None:
+        now = timezone.now()
+        token = make_ticket_token(uuid.uuid4(), 'Alpha', 'Beta', now, now + TICKET_LIFETIME)
+        tampered = token[:10] + ('A' if token[10] != 'A' else 'B') + token[11:]
+        self.assertIsNone(read_ticket_token(tampered))
+        self.assertIsNone(read_ticket_token('not a token'))
+
+    def test_long_station_names_survive(self) -> None:
+        now = timezone.now()
+        start, stop = 'Ω' * 200, 'Station ' * 25
+        claims = read_ticket_token(make_ticket_token(uuid.uuid4(), start, stop, now, now + TICKET_LIFETIME))
+        self.assertEqual((claims.start, claims.stop), (start, stop))
+
+    def test_version_one_tokens_are_still_read(self) -> None:
+        now = timezone.now()
+        id = uuid.uuid4()
+        payload = HEADER.pack(1, id.bytes, int(now.timestamp()), int((now + TICKET_LIFETIME).timestamp())) + b'\x05Alpha\x04Beta'
+        token = base64.urlsafe_b64encode(payload + _sign(payload)).rstrip(b'=').decode()
+        self.assertEqual(read_ticket_token(token)[:3], (id, 'Alpha', 'Beta'))
+
+
+class ChangeFeedEncodingTests(TestCase):
+
+    def test_binary_record_holds_long_names(self) -> None:
+        start = 'Ω' * 200
+        record = encode_binary(3, 7, uuid.uuid4(), 'ACTIVE', timezone.now(), start, 'Beta')
+        size, = NAME_LENGTH.unpack_from(record, RECORD_HEADER.size)
+        self.assertEqual(record[RECORD_HEADER.size + NAME_LENGTH.size:][:size].decode(), start)
+        self.assertEqual(record[-6:], NAME_LENGTH.pack(4) + b'Beta')
+
+
+class TicketChangeFeedTests(TransactionTestCase):
+    """The feed only serves committed transactions, so these tests commit instead of running in one transaction."""
+
+    def setUp(self) -> None:
+        user = get_user_model().objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.client.force_login(user)
+        start = Station.objects.create(name='Alpha')
+        self.tickets = [Ticket.objects.create(start=start, stop=start, price=Decimal('5.00')) for _ in range(3)]
+
+    def _feed(self, **params) -> list[dict]:
+        response = self.client.get('/tickets/scanner/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_feed_resumes_from_the_cursor(self) -> None:
+        first = self._feed(limit=2)
+        self.assertEqual([record['id'] for record in first], [str(ticket.pk) for ticket in self.tickets[:2]])
+        Ticket.scan([self.tickets[0].pk])
+        rest = self._feed(cursor=f"{first[-1]['xact']}.{first[-1]['seq']}")
+        self.assertEqual([(record['id'], record['status']) for record in rest], [(str(self.tickets[2].pk), 'ACTIVE'), (str(self.tickets[0].pk), 'IN_USE')])
+
+    def test_unfinished_transactions_are_held_back(self) -> None:
+        held = Ticket.objects.get(pk=self.tickets[1].pk).change_xact
+        with mock.patch.object(Ticket, 'change_watermark', return_value=held):
+            self.assertEqual([record['id'] for record in self._feed()], [str(self.tickets[0].pk)])
+
+    def test_limit_and_cursor_must_be_valid(self) -> None:
+        for params in ({'limit': '-1'}, {'limit': '0'}, {'limit': 'x'}, {'cursor': '5'}, {'cursor': '-1.0'}):
+            self.assertEqual(self.client.get('/tickets/scanner/changes/', params).status_code, 400)
@@ -0,0 +1,112 @@
+import math
+import uuid
+import base64
+import struct
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+from typing import Iterable, NamedTuple
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+TOKEN_VERSION = 2
+TOKEN_SALT = 'tickets.tokens.ticket'
+SIGNATURE_SIZE = 16
+HEADER = struct.Struct('>B16sII')
+FILTER_HEADER = struct.Struct('>IB')
+# Version 1 tokens stored names behind a single length byte, which cannot hold every station name
+NAME_LENGTHS = {1: struct.Struct('>B'), 2: struct.Struct('>H')}
+
+
+class TicketClaims(NamedTuple):
+    id: uuid.UUID
+    start: str
+    stop: str
+    created_at: datetime
+    expires_at: datetime
+
+    def expired(self, now: datetime | None = None) -> bool:
+        return (now or datetime.now(dt_timezone.utc)) > self.expires_at
+
+
+def make_ticket_token(id: uuid.UUID, start: str, stop: str, created_at: datetime, expires_at: datetime) -> str:
+    payload = HEADER.pack(TOKEN_VERSION, id.bytes, int(created_at.timestamp()), int(expires_at.timestamp()))
+    payload += _pack_name(start) + _pack_name(stop)
+    return base64.urlsafe_b64encode(payload + _sign(payload)).rstrip(b'=').decode()
+
+def read_ticket_token(token: str) -> TicketClaims | None:
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+    payload, signature = data[:-SIGNATURE_SIZE], data[-SIGNATURE_SIZE:]
+    if len(payload) < HEADER.size + 2 or not constant_time_compare(signature, _sign(payload)):
+        return None
+    version, id, created_at, expires_at = HEADER.unpack_from(payload)
+    if version not in NAME_LENGTHS:
+        return None
+    start, offset = _unpack_name(payload, HEADER.size, NAME_LENGTHS[version])
+    stop, _ = _unpack_name(payload, offset, NAME_LENGTHS[version])
+    return TicketClaims(
+        id=uuid.UUID(bytes=id),
+        start=start,
+        stop=stop,
+        created_at=datetime.fromtimestamp(created_at, dt_timezone.utc),
+        expires_at=datetime.fromtimestamp(expires_at, dt_timezone.utc)
+    )
+
+def _sign(payload: bytes) -> bytes:
+    return salted_hmac(TOKEN_SALT, payload, secret=settings.TICKET_TOKEN_SECRET, algorithm='sha256').digest()[:SIGNATURE_SIZE]
+
+def _pack_name(name: str) -> bytes:
+    encoded = name.encode()
+    return NAME_LENGTHS[TOKEN_VERSION].pack(len(encoded)) + encoded
+
+def _unpack_name(payload: bytes, offset: int, length: struct.Struct) -> tuple[str, int]:
+    size, = length.unpack_from(payload, offset)
+    offset += length.size
+    return payload[offset:offset + size].decode(), offset + size
+
+
+class BloomFilter:
+    __slots__ = ('size', 'hashes', 'bits')
+
+    def __init__(self, size: int, hashes: int, bits: bytearray | None = None) -> None:
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = 0.001) -> 'BloomFilter':
+        capacity = max(capacity, 1)
+        size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        return cls(size, max(round(size / capacity * math.log(2)), 1))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BloomFilter':
+        size, hashes = FILTER_HEADER.unpack_from(data)
+        return cls(size, hashes, bytearray(data[FILTER_HEADER.size:]))
+
+    def to_bytes(self) -> bytes:
+        return FILTER_HEADER.pack(self.size, self.hashes) + bytes(self.bits)
+
+    def add(self, key: bytes) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, keys: Iterable[bytes]) -> None:
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def _positions(self, key: bytes) -> Iterable[int]:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first, second = struct.unpack('>QQ', digest)
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+
+def build_revocation_filter(ids: list[uuid.UUID]) -> BloomFilter:
+    bloom = BloomFilter.for_capacity(len(ids))
+    bloom.update(id.bytes for id in ids)
+    return bloom
@@ -4,10 +4,14 @@ from .views import (
     TicketPurchaseView, 
     WalletBalanceUpdateView, 
     TicketScanUpdateView, 
+    TicketScanBatchView,
+    RevocationFilterView,
+    TicketChangeFeedView,
     TicketPurchaseOfflineView,
     ScannerTemplateView,
     DashboardTemplateView,
-    ConfirmTicketPurchase
+    ConfirmTicketPurchase,
+    TicketQuoteView
 )
 
 app_name = 'tickets'
@@ -16,8 +20,12 @@ urlpatterns = [
     path('buy/', TicketPurchaseView.as_view(), name='ticket_purchase'),
     path('dashboard/add-funds/', WalletBalanceUpdateView.as_view(), name='wallet_balance_update'),
     path('scanner/scan/', TicketScanUpdateView.as_view(), name='ticket_scan'),
+    path('scanner/scan/batch/', TicketScanBatchView.as_view(), name='ticket_scan_batch'),
+    path('scanner/revocations/', RevocationFilterView.as_view(), name='revocations'),
+    path('scanner/changes/', TicketChangeFeedView.as_view(), name='ticket_changes'),
     path('scanner/buy/', TicketPurchaseOfflineView.as_view(), name='ticket_purchase_offline'),
     path('scanner/', ScannerTemplateView.as_view(), name='scanner'),
     path('dashboard/', DashboardTemplateView.as_view(), name='dashboard'),
-    path('confirm/', ConfirmTicketPurchase.as_view(), name='confirm')
+    path('confirm/', ConfirmTicketPurchase.as_view(), name='confirm'),
+    path('quote/', TicketQuoteView.as_view(), name='ticket_quote')
 ]
@@ -1,38 +1,127 @@
+import time
 import random
+import logging
+from datetime import timedelta
 from decimal import Decimal
-from threading import Thread
-from functools import wraps
+from typing import Iterable
+from threading import Lock, Thread
 from django.conf import settings
-from django.core.mail import send_mail
-from stations.utils import calculate_route
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from config.instrumentation import cache_lookup, section
+from stations.utils import calculate_hops, calculate_hops_many
 from stations.models import Station
+from .models import OutboundEmail, Ticket
+from .tokens import build_revocation_filter
+
+logger = logging.getLogger(__name__)
+
+CACHE = {}
+
+PRICE_PER_HOP = Decimal(10.0)
+
+OUTBOX_LOCK = Lock()
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=5)
+MAX_EMAIL_ATTEMPTS = 8
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=1)
+
+REVOCATION_REFRESH = 30.0
 
 def calculate_ticket_price(start: Station, stop: Station) -> Decimal:
     if start == stop:
         return Decimal('0.00')
-    path = calculate_route(start, stop)
-    length = len(path) - 1
-    if length == -1:
+    hops = calculate_hops(start, stop)
+    if hops is None:
         return Decimal('0.00')
-    return Decimal(length) * Decimal(10.0)
+    return Decimal(hops) * PRICE_PER_HOP
 
-def _parallel(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        thread = Thread(target=func, args=args, kwargs=kwargs)
-        thread.start()
-        
-    return wrapper
+def calculate_ticket_prices(pairs: Iterable[tuple[str, str]]) -> list[tuple[Decimal | None, int | None]]:
+    prices: dict[int, Decimal] = {}
+    quotes = []
+    for hops in calculate_hops_many(pairs):
+        if hops is None:
+            quotes.append((None, None))
+            continue
+        if hops not in prices:
+            prices[hops] = Decimal(hops) * PRICE_PER_HOP if hops else Decimal('0.00')
+        quotes.append((prices[hops], hops))
+    return quotes
 
-@_parallel
 def send_email(user_email: str, subject: str, message: str) -> None:
-    send_mail(
-        subject=subject,
-        message=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[user_email],
-        fail_silently=False
-    )
+    with section('email'):
+        OutboundEmail.objects.create(recipient=user_email, subject=subject, body=message)
+    transaction.on_commit(wake_outbox)
+
+def wake_outbox() -> None:
+    if not OUTBOX_LOCK.locked():
+        Thread(target=_deliver_in_background, name='outbox-sender', daemon=True).start()
+
+def deliver_outbox(batch_size: int = OUTBOX_BATCH_SIZE) -> tuple[int, int]:
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(OutboundEmail.pending().select_for_update(skip_locked=True).filter(
+            next_attempt_at__lte=now
+        ).order_by('next_attempt_at')[:batch_size])
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + OUTBOX_CLAIM_TIMEOUT
+        )
+    if not emails:
+        return 0, 0
+    sent = []
+    failed = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for email in emails:
+            try:
+                connection.send_messages([EmailMessage(email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.recipient])])
+            except Exception as e:
+                failed += 1
+                _retry_email(email, e)
+            else:
+                sent.append(email.pk)
+    except Exception as e:
+        for email in emails[len(sent) + failed:]:
+            failed += 1
+            _retry_email(email, e)
+    finally:
+        connection.close()
+        OutboundEmail.objects.filter(pk__in=sent).update(sent_at=timezone.now(), next_attempt_at=None, last_error='')
+    return len(sent), failed
+
+def _retry_email(email: OutboundEmail, error: Exception) -> None:
+    attempts = email.attempts + 1
+    if attempts >= MAX_EMAIL_ATTEMPTS:
+        next_attempt_at = None
+        logger.error('Giving up on e-mail %s to %s after %s attempts: %s', email.pk, email.recipient, attempts, error)
+    else:
+        next_attempt_at = timezone.now() + min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+    OutboundEmail.objects.filter(pk=email.pk).update(last_error=f'{type(error).__name__}: {error}', next_attempt_at=next_attempt_at)
+
+def _deliver_in_background() -> None:
+    if not OUTBOX_LOCK.acquire(blocking=False):
+        return
+    try:
+        while sum(deliver_outbox()):
+            pass
+    except Exception:
+        logger.exception('Outbox delivery failed')
+    finally:
+        OUTBOX_LOCK.release()
+        db_connection.close()
+
+def get_revocation_filter() -> tuple[bytes, float]:
+    now = time.time()
+    if not cache_lookup('revocations' in CACHE and now - CACHE['revocations_generated_at'] <= REVOCATION_REFRESH):
+        with section('revocations'):
+            CACHE['revocations'] = build_revocation_filter(Ticket.revoked_ids()).to_bytes()
+        CACHE['revocations_generated_at'] = now
+    return CACHE['revocations'], CACHE['revocations_generated_at']
 
 def generate_otp() -> str:
     choices = random.choices(range(10), k=6)
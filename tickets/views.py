@@ -1,69 +1,87 @@
+import json
+import uuid
+from collections import Counter
 from typing import Any
+from datetime import datetime
 from decimal import Decimal
 from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
 from django.db.models.base import Model as Model
 from django.db.models.query import QuerySet
 from django.forms import BaseModelForm
-from django.http import HttpResponse
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.views import generic
+from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from .models import Ticket, Wallet, OTP
-from .utils import calculate_ticket_price, send_email, generate_otp
-from .forms import WalletBalanceUpdateForm, TicketScanUpdateForm, OTPConfirmationForm
-from stations.models import Station
+from config.instrumentation import section
+from config.metrics import OTP_CONFIRM_FAILURES, OTP_SENT, TICKETS_PURCHASED
+from .models import Ticket, Wallet, WalletTransaction, TICKET_LIFETIME
+from .otp import OTPStatus, get_otp_backend
+from .feed import FEED_COLUMNS, encode_ndjson, encode_binary
+from .tokens import read_ticket_token
+from .utils import calculate_ticket_prices, send_email, get_revocation_filter, REVOCATION_REFRESH
+from .forms import WalletBalanceUpdateForm, TicketScanUpdateForm, OTPConfirmationForm, TicketPurchaseForm
+from stations.snapshot import StationRecord
 
 
 # Create your views here.
 
+MAX_QUOTE_PAIRS = 1000
+MAX_SCAN_BATCH = 1000
+MAX_FEED_RECORDS = 100000
+FEED_CHUNK_SIZE = 2000
+TICKET_PAGE_SIZE = 25
+TICKET_STATUS_FILTERS = {'active': 'Active', 'in_use': 'In Use', 'used': 'Used', 'expired': 'Expired'}
+TICKET_BADGES = {
+    Ticket.State.ACTIVE: ('Active', 'valid'),
+    Ticket.State.IN_USE: ('In Use', 'pending'),
+    Ticket.State.USED: ('Used', 'used'),
+    Ticket.State.EXPIRED: ('Expired', 'expired')
+}
+FEED_FORMATS = {
+    'ndjson': (encode_ndjson, 'application/x-ndjson'),
+    'binary': (encode_binary, 'application/octet-stream')
+}
 
-class TicketPurchaseView(LoginRequiredMixin, generic.CreateView):
-    model = Ticket
-    fields = ['start', 'stop']
+
+class TicketPurchaseView(LoginRequiredMixin, generic.FormView):
+    form_class = TicketPurchaseForm
     template_name = 'tickets/ticket_purchase_form.html'
     success_url = '/tickets/confirm/'
 
-    def form_valid(self, form: BaseModelForm) -> HttpResponse:
-        start = form.instance.start
-        stop = form.instance.stop
-        if not start.lines.filter(allow_ticket_purchase=True).exists():
-            messages.error(self.request, f'Ticket Purchase is Disabled for {start.name}!')
-            return self.form_invalid(form)
-        elif not stop.lines.filter(allow_ticket_purchase=True).exists():
-            messages.error(self.request, f'Ticket Purchase is Disabled for {stop.name}!')
-            return self.form_invalid(form)
-        elif start == stop:
-            messages.error(self.request, 'Start and Destination cannot be the same!')
-            return self.form_invalid(form)
-        price = calculate_ticket_price(start, stop)
-        if price == 0:
-            messages.error(self.request, 'No Route exists between these Stations!')
+    def form_valid(self, form: TicketPurchaseForm) -> HttpResponse:
+        start = form.cleaned_data['start']
+        stop = form.cleaned_data['stop']
+        price = _quote_purchase(self.request, start, stop)
+        if price is None:
             return self.form_invalid(form)
         wallet = Wallet.objects.get_or_create(user=self.request.user)[0]
         if wallet.balance < price:
             messages.error(self.request, 'Insufficient wallet funds for the above route!')
             return self.form_invalid(form)
         self.request.session['pending_data'] = {
-            'start': start.pk,
-            'stop': stop.pk,
+            'start': start.name,
+            'stop': stop.name,
             'price': str(price)
         }
-        otp = OTP.objects.get_or_create(
-            user=self.request.user,
-            )[0]
-        otp.code = generate_otp()
-        otp.save()
+        with section('otp'):
+            code = get_otp_backend().issue(self.request.user.pk)
+        OTP_SENT.inc()
         send_email(
             user_email=self.request.user.email, # type: ignore
             subject='OTP for Metro Ticket Purchase',
-            message=f'Your OTP Code is {otp.code}'
+            message=f'Your OTP Code is {code}'
         )
         return redirect('/tickets/confirm/')
 
 
 class ConfirmTicketPurchase(LoginRequiredMixin, generic.FormView):
-    model = OTP
     form_class = OTPConfirmationForm
     template_name = 'tickets/confirm_otp_code_form.html'
     success_url = '/tickets/my/'
@@ -81,34 +99,37 @@ class ConfirmTicketPurchase(LoginRequiredMixin, generic.FormView):
         if pending_data is None:
             messages.error(self.request, 'No valid confirmation request found!')
             return self.form_invalid(form)
-        otp = OTP.objects.filter(user=user, code=otp_entered).first()
-        if otp is None:
-            messages.error(self.request, 'Invalid OTP Code')
-            return self.form_invalid(form)
-        elif otp.expired(): # type: ignore
-            messages.error(self.request, 'OTP Expired!')
-            otp.delete()
-            return self.form_invalid(form)
-        otp.delete()
-        stations = Station.objects.in_bulk([pending_data['start'], pending_data['stop']])
-        start = stations.get(pending_data['start'])
-        stop = stations.get(pending_data['stop'])
+        with section('otp'):
+            status = get_otp_backend().verify(user.pk, otp_entered)
+        match status:
+            case OTPStatus.INVALID:
+                OTP_CONFIRM_FAILURES.labels('invalid').inc()
+                messages.error(self.request, 'Invalid or Expired OTP Code')
+                return self.form_invalid(form)
+            case OTPStatus.LOCKED:
+                OTP_CONFIRM_FAILURES.labels('locked').inc()
+                messages.error(self.request, 'Too many incorrect attempts! Please request a new OTP.')
+                return self.form_invalid(form)
+        start = pending_data['start']
+        stop = pending_data['stop']
         price = Decimal(pending_data['price'])
         try:
             with transaction.atomic():
-                wallet = Wallet.objects.select_for_update().get_or_create(user=user)[0]
-                if not wallet.deduct(price):
+                ticket_id = uuid.uuid4()
+                if Wallet.debit(user.pk, price, WalletTransaction.Kind.PURCHASE, ticket_id) is None:
                     raise Exception('Insufficient Funds')
                 ticket = Ticket.objects.create(
+                    id=ticket_id,
                     user=user,
-                    start=start,
-                    stop=stop,
+                    start_id=start,
+                    stop_id=stop,
                     price=price
                 )
+                transaction.on_commit(TICKETS_PURCHASED.labels('online').inc)
                 send_email(
                     user_email=self.request.user.email, # type: ignore
                     subject='Ticket Details',
-                    message=f'Ticket ID: {ticket.id}\nStart Station: {ticket.start.name}\nDestination Station: {ticket.stop.name}\nCreated At: {ticket.created_at}\nPrice: {ticket.price}'
+                    message=f'Ticket ID: {ticket.id}\nStart Station: {start}\nDestination Station: {stop}\nCreated At: {ticket.created_at}\nPrice: {ticket.price}\nGate Token: {ticket.token}'
                 )
                 del self.request.session['pending_data']
                 return redirect('tickets:ticket_list')
@@ -117,14 +138,81 @@ class ConfirmTicketPurchase(LoginRequiredMixin, generic.FormView):
             return redirect('tickets:wallet_balance_update')
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class TicketQuoteView(generic.View):
+    http_method_names = ['post']
+
+    def post(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        try:
+            pairs = json.loads(request.body)['pairs']
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({'error': 'Expected a JSON object with a "pairs" list.'}, status=400)
+        if not isinstance(pairs, list) or not all(isinstance(pair, list) and len(pair) == 2 and all(isinstance(pk, str) for pk in pair) for pair in pairs):
+            return JsonResponse({'error': 'Each pair must be a [start, stop] list of station names.'}, status=400)
+        if len(pairs) > MAX_QUOTE_PAIRS:
+            return JsonResponse({'error': f'At most {MAX_QUOTE_PAIRS} pairs can be quoted at once.'}, status=400)
+        quotes = calculate_ticket_prices(pairs)
+        return JsonResponse({'quotes': [
+            {'start': start, 'stop': stop, 'hops': hops, 'price': None if price is None else str(price)}
+            for (start, stop), (price, hops) in zip(pairs, quotes)
+        ]})
+
+
 class TicketListView(LoginRequiredMixin, generic.ListView):
     model = Ticket
     template_name = 'tickets/ticket_list.html'
     context_object_name = 'tickets'
-    ordering = ['-created_at']
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        self.status = request.GET.get('status', '')
+        if self.status not in TICKET_STATUS_FILTERS:
+            self.status = ''
+        self.cursor = _decode_cursor(request.GET.get('cursor', ''))
+        self.object_list = self.get_queryset()
+        tickets = list(self.object_list[:TICKET_PAGE_SIZE + 1])
+        next_cursor = _encode_cursor(tickets[TICKET_PAGE_SIZE - 1]) if len(tickets) > TICKET_PAGE_SIZE else None
+        tickets = tickets[:TICKET_PAGE_SIZE]
+        for ticket in tickets:
+            ticket['label'], ticket['badge'] = TICKET_BADGES[ticket['status']]
+        if request.GET.get('format') == 'json':
+            return JsonResponse({
+                'tickets': [{
+                    'id': ticket['id'],
+                    'start': ticket['start_id'],
+                    'stop': ticket['stop_id'],
+                    'price': str(ticket['price']),
+                    'status': ticket['status'],
+                    'created_at': ticket['created_at'].isoformat()
+                } for ticket in tickets],
+                'next': next_cursor
+            })
+        return self.render_to_response(self.get_context_data(
+            object_list=tickets,
+            tickets=tickets,
+            next_cursor=next_cursor,
+            status=self.status,
+            status_filters=TICKET_STATUS_FILTERS
+        ))
 
     def get_queryset(self) -> QuerySet[Any]:
-        return Ticket.objects.filter(user=self.request.user).select_related('start', 'stop')
+        stale = timezone.now() - TICKET_LIFETIME
+        queryset = Ticket.objects.filter(user=self.request.user)
+        match self.status:
+            case 'active':
+                queryset = queryset.filter(raw_status=Ticket.State.ACTIVE, created_at__gte=stale)
+            case 'in_use':
+                queryset = queryset.filter(raw_status=Ticket.State.IN_USE)
+            case 'used':
+                queryset = queryset.filter(raw_status=Ticket.State.USED)
+            case 'expired':
+                queryset = queryset.filter(Q(raw_status=Ticket.State.EXPIRED) | Q(raw_status=Ticket.State.ACTIVE, created_at__lt=stale))
+        if self.cursor is not None:
+            created_at, pk = self.cursor
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return queryset.annotate(status=Case(
+            When(raw_status=Ticket.State.ACTIVE, created_at__lt=stale, then=Value(Ticket.State.EXPIRED.value)),
+            default=F('raw_status')
+        )).order_by('-created_at', '-id').values('id', 'start_id', 'stop_id', 'price', 'status', 'created_at')
     
 
 class WalletBalanceUpdateView(LoginRequiredMixin, generic.FormView):
@@ -140,7 +228,7 @@ class WalletBalanceUpdateView(LoginRequiredMixin, generic.FormView):
     def form_valid(self, form: BaseModelForm) -> HttpResponse:
         wallet = Wallet.objects.get_or_create(user=self.request.user)[0]
         amount = form.cleaned_data.get('amount')
-        wallet.add(amount) #type: ignore
+        wallet.add(amount, WalletTransaction.Kind.TOPUP) #type: ignore
         return redirect(self.get_success_url())
     
 
@@ -152,59 +240,119 @@ class TicketScanUpdateView(LoginRequiredMixin, UserPassesTestMixin, generic.Form
     def test_func(self) -> bool | None:
         return self.request.user.is_staff
     
-    def form_valid(self, form: BaseModelForm) -> HttpResponse:
-        ticket_id = form.cleaned_data.get('ticket_id')
-        
-        with transaction.atomic():
-            ticket = Ticket.objects.select_for_update().get(id=ticket_id)
-            match ticket.status:
-                case Ticket.State.ACTIVE:
-                    status = ticket.State.IN_USE
-                case Ticket.State.IN_USE:
-                    status = ticket.State.USED
-                case _:
-                    messages.error(self.request, 'Ticket is already used or expired.')
-                    return redirect(self.request.path)
-            Ticket.objects.filter(pk=ticket.pk).update(raw_status=status)
+    def form_valid(self, form: TicketScanUpdateForm) -> HttpResponse:
+        ticket_id = form.cleaned_data['ticket_id']
+        match Ticket.scan([ticket_id])[0]:
+            case Ticket.Scan.NOT_FOUND:
+                form.add_error(None, 'Ticket Does Not Exist!')
+                return self.form_invalid(form)
+            case Ticket.Scan.EXPIRED:
+                form.add_error(None, 'Ticket is Expired!')
+                return self.form_invalid(form)
+            case Ticket.Scan.USED:
+                form.add_error(None, 'Ticket has already been Used!')
+                return self.form_invalid(form)
+            case Ticket.Scan.CONFLICT:
+                messages.error(self.request, 'Ticket is already used or expired.')
+                return redirect(self.request.path)
         return redirect(self.get_success_url())
+
+
+class TicketScanBatchView(LoginRequiredMixin, UserPassesTestMixin, generic.View):
+    # Gate controllers sign in as staff like the scanner pages, so they send the csrftoken cookie back as X-CSRFToken
+    http_method_names = ['post']
+    raise_exception = True
+
+    def test_func(self) -> bool | None:
+        return self.request.user.is_staff
+
+    def post(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        try:
+            tickets = json.loads(request.body)['tickets']
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({'error': 'Expected a JSON object with a "tickets" list.'}, status=400)
+        if not isinstance(tickets, list) or not all(isinstance(ticket, str) for ticket in tickets):
+            return JsonResponse({'error': 'Tickets must be a list of ticket IDs.'}, status=400)
+        if len(tickets) > MAX_SCAN_BATCH:
+            return JsonResponse({'error': f'At most {MAX_SCAN_BATCH} tickets can be scanned at once.'}, status=400)
+        ids = [_parse_ticket(ticket) for ticket in tickets]
+        outcomes = iter(Ticket.scan([pk for pk in ids if pk is not None]))
+        results = [{'ticket': ticket, 'outcome': 'invalid' if pk is None else next(outcomes)} for ticket, pk in zip(tickets, ids)]
+        return JsonResponse({
+            'results': results,
+            'counts': Counter(result['outcome'] for result in results)
+        })
     
 
-class TicketPurchaseOfflineView(LoginRequiredMixin, UserPassesTestMixin, generic.CreateView):
-    model = Ticket
-    fields = ['start', 'stop']
+class RevocationFilterView(LoginRequiredMixin, UserPassesTestMixin, generic.View):
+    http_method_names = ['get']
+    raise_exception = True
+
+    def test_func(self) -> bool | None:
+        return self.request.user.is_staff
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        data, generated_at = get_revocation_filter()
+        response = get_conditional_response(request, etag=f'"revocations-{generated_at:.0f}"')
+        if response is None:
+            response = HttpResponse(data, content_type='application/octet-stream')
+            response['ETag'] = f'"revocations-{generated_at:.0f}"'
+        response['X-Generated-At'] = f'{generated_at:.0f}'
+        patch_cache_control(response, private=True, max_age=int(REVOCATION_REFRESH))
+        return response
+
+
+class TicketChangeFeedView(LoginRequiredMixin, UserPassesTestMixin, generic.View):
+    http_method_names = ['get']
+    raise_exception = True
+
+    def test_func(self) -> bool | None:
+        return self.request.user.is_staff
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        cursor = _parse_feed_cursor(request.GET.get('cursor', '0.0'))
+        if cursor is None:
+            return JsonResponse({'error': 'cursor must be the xact and seq of the last record, as "xact.seq".'}, status=400)
+        try:
+            limit = min(int(request.GET.get('limit', MAX_FEED_RECORDS)), MAX_FEED_RECORDS)
+        except ValueError:
+            return JsonResponse({'error': 'limit must be an integer.'}, status=400)
+        if limit < 1:
+            return JsonResponse({'error': 'limit must be at least 1.'}, status=400)
+        format = request.GET.get('format', 'ndjson')
+        if format not in FEED_FORMATS:
+            return JsonResponse({'error': f'format must be one of: {", ".join(FEED_FORMATS)}.'}, status=400)
+        encode, content_type = FEED_FORMATS[format]
+        # Only changes from finished transactions are served, so one still in flight can never land behind the cursor
+        watermark = Ticket.change_watermark()
+        rows = Ticket.changes(*cursor, watermark).values_list(*FEED_COLUMNS)[:limit]
+        response = StreamingHttpResponse((encode(*row) for row in rows.iterator(chunk_size=FEED_CHUNK_SIZE)), content_type=content_type)
+        response['X-Feed-Watermark'] = str(watermark)
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+class TicketPurchaseOfflineView(LoginRequiredMixin, UserPassesTestMixin, generic.FormView):
+    form_class = TicketPurchaseForm
     template_name = 'scanner/ticket_purchase_offline_form.html'
     success_url = '/tickets/scanner/'
 
     def test_func(self) -> bool | None:
         return self.request.user.is_staff
     
-    def form_valid(self, form: BaseModelForm) -> HttpResponse:
-        start = form.instance.start
-        stop = form.instance.stop
-        price = calculate_ticket_price(start, stop)
-        if start is None or stop is None or price is None:
-            messages.error(self.request, 'Invalid confirmation request!')
-            return self.form_invalid(form)
-        if not start.lines.filter(allow_ticket_purchase=True).exists():
-            messages.error(self.request, f'Ticket Purchase is Disabled for {start.name}!')
-            return self.form_invalid(form)
-        elif not stop.lines.filter(allow_ticket_purchase=True).exists():
-            messages.error(self.request, f'Ticket Purchase is Disabled for {stop.name}!')
-            return self.form_invalid(form)
-        elif start == stop:
-            messages.error(self.request, 'Start and Destination cannot be the same!')
-            return self.form_invalid(form)
-        price = calculate_ticket_price(start, stop)
-        if price == 0:
-            messages.error(self.request, 'No Route exists between these Stations!')
+    def form_valid(self, form: TicketPurchaseForm) -> HttpResponse:
+        start = form.cleaned_data['start']
+        stop = form.cleaned_data['stop']
+        price = _quote_purchase(self.request, start, stop)
+        if price is None:
             return self.form_invalid(form)
         ticket = Ticket.objects.create(
             user=None,
-            start=start,
-            stop=stop,
+            start_id=start.name,
+            stop_id=stop.name,
             price=price
         )
-        self.object = ticket
+        TICKETS_PURCHASED.labels('offline').inc()
         messages.success(self.request, f'Purchase Successful! Ticket ID is: {ticket.id}')
         return redirect('/tickets/scanner/')
     
@@ -224,3 +372,45 @@ class ScannerTemplateView(LoginRequiredMixin, UserPassesTestMixin, generic.Templ
 
     def test_func(self) -> bool | None:
         return self.request.user.is_staff
+
+
+def _quote_purchase(request: HttpRequest, start: StationRecord, stop: StationRecord) -> Decimal | None:
+    if not start.purchasable:
+        messages.error(request, f'Ticket Purchase is Disabled for {start.name}!')
+        return None
+    elif not stop.purchasable:
+        messages.error(request, f'Ticket Purchase is Disabled for {stop.name}!')
+        return None
+    elif start.name == stop.name:
+        messages.error(request, 'Start and Destination cannot be the same!')
+        return None
+    price, _ = calculate_ticket_prices([(start.name, stop.name)])[0]
+    if not price:
+        messages.error(request, 'No Route exists between these Stations!')
+        return None
+    return price
+
+
+def _parse_ticket(value: str) -> uuid.UUID | None:
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        claims = read_ticket_token(value)
+        return None if claims is None else claims.id
+
+def _parse_feed_cursor(value: str) -> tuple[int, int] | None:
+    try:
+        xact, sequence = (int(part) for part in value.split('.'))
+    except ValueError:
+        return None
+    return (xact, sequence) if xact >= 0 and sequence >= 0 else None
+
+def _encode_cursor(ticket: dict[str, Any]) -> str:
+    return urlsafe_base64_encode(f'{ticket["created_at"].isoformat()}|{ticket["id"]}'.encode())
+
+def _decode_cursor(value: str) -> tuple[datetime, uuid.UUID] | None:
+    try:
+        created_at, pk = urlsafe_base64_decode(value).decode().split('|')
+        return datetime.fromisoformat(created_at), uuid.UUID(pk)
+    except ValueError:
+        return None